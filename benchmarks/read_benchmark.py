@@ -0,0 +1,55 @@
+"""Per-file .pico parsing benchmark
+
+Compares the fast .pico parser against the generic json parser on the
+unit test data files.
+
+Usage:
+    python benchmarks/read_benchmark.py [repeats]
+"""
+import glob
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from piccololite import io
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, '..', 'test', 'unit', 'data')
+
+
+def _json_read(fpath):
+    # previous behaviour: json decode then convert the lists of ints
+    with open(fpath, 'r') as f:
+        data = json.loads(f.read())
+    return [np.array(x['Pixels'], dtype=float) for x in data['Spectra']]
+
+
+def _fast_read(fpath):
+    with open(fpath, 'r') as f:
+        data = io._parse_pico_string(f.read())
+    return [np.asarray(x['Pixels'], dtype=float) for x in data['Spectra']]
+
+
+def main(repeats=20):
+    files = sorted(glob.glob(os.path.join(DATA, '*.pico')))
+    print('{:<30}{:>12}{:>12}{:>10}'.format('file', 'json (ms)',
+                                             'fast (ms)', 'speedup'))
+    total_json = total_fast = 0
+    for fpath in files:
+        t_json = min(timeit.repeat(lambda: _json_read(fpath), number=1,
+                                   repeat=repeats)) * 1000
+        t_fast = min(timeit.repeat(lambda: _fast_read(fpath), number=1,
+                                   repeat=repeats)) * 1000
+        total_json += t_json
+        total_fast += t_fast
+        print('{:<30}{:>12.3f}{:>12.3f}{:>9.1f}x'.format(
+            os.path.basename(fpath), t_json, t_fast, t_json / t_fast))
+    print('{:<30}{:>12.3f}{:>12.3f}{:>9.1f}x'.format(
+        'total', total_json, total_fast, total_json / total_fast))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
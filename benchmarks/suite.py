@@ -0,0 +1,285 @@
+"""End to end benchmark suite
+
+Generates a synthetic sequence by scaling the unit test .pico files to
+N files x M pixels x K instruments, then times each stage of the pipeline
+(read, correct, aggregate, calibrate and write) and records throughput and
+peak traced memory. Results are written as a JSON report, which can be
+compared against the report of a previous run to catch regressions.
+
+Usage:
+    python benchmarks/suite.py --files 100 --pixels 2048 --instruments 2 \
+        --output report.json [--baseline previous.json]
+"""
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas
+import xarray
+
+from piccololite import RadiometricCorrection, aggregate_sequence, \
+    generate_calibration, read_piccolo_sequence, sequence_to_netcdf
+from piccololite._version import __version__
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, '..', 'test', 'unit', 'data')
+REFERENCE = os.path.join(DATA, 'F1380_irradiance.nc')
+# files from the same run as the templates
+TEMPLATES = {
+    'dark': os.path.join(DATA, 'b000000_s000000_dark.pico'),
+    'light': os.path.join(DATA, 'b000000_s000000_light.pico'),
+}
+
+
+def generate_sequence(directory, n_files=100, n_pixels=None,
+                      n_instruments=2, dark_every=10, seed=0):
+    """Write a synthetic sequence based on the unit test files.
+
+    Instruments are copies of the test instruments (alternating QEP and
+    FLMS) with new serials. Spectra are resampled to n_pixels with the
+    wavelength calibration adjusted to cover the same range, and a dark
+    file is written every dark_every files.
+
+    Args:
+        directory (str): output directory
+        n_files (int): number of .pico files
+        n_pixels (int): pixels per spectrum. Defaults to the native count
+        n_instruments (int): number of instruments per file
+        dark_every (int): files between dark files
+        seed (int): random seed of the pixel noise
+
+    Returns:
+        list of calibration file paths, one per instrument
+    """
+    rng = np.random.default_rng(seed)
+    templates = {}
+    for kind, path in TEMPLATES.items():
+        with open(path) as f:
+            templates[kind] = json.load(f)['Spectra']
+    serials = sorted(set(s['Metadata']['SerialNumber']
+                         for s in templates['light']))
+    start = datetime.datetime(2020, 5, 30, 12)
+
+    for i in range(n_files):
+        kind = 'dark' if i % dark_every == 0 else 'light'
+        time_stamp = start + datetime.timedelta(seconds=0.8 * i)
+        spectra = []
+        for k in range(n_instruments):
+            template_serial = serials[k % len(serials)]
+            for spectrum in templates[kind]:
+                meta = spectrum['Metadata']
+                if meta['SerialNumber'] != template_serial:
+                    continue
+                spectra.append(_scale_spectrum(
+                    spectrum, _serial(template_serial, k), n_pixels,
+                    time_stamp, i, rng))
+        fname = 'b000000_s{:06d}_{}.pico'.format(i, kind)
+        with open(os.path.join(directory, fname), 'w') as f:
+            json.dump({'Spectra': spectra}, f, indent=1)
+
+    cal_paths = []
+    for k in range(n_instruments):
+        serial = _serial(serials[k % len(serials)], k)
+        path = os.path.join(directory, '{}_CalCoeffs.csv'.format(serial))
+        spectrum = [s for s in templates['light']
+                    if s['Metadata']['SerialNumber'] ==
+                    serials[k % len(serials)]][0]
+        wvl = _wavelengths(_scale_metadata(spectrum['Metadata'], n_pixels,
+                                           len(spectrum['Pixels'])),
+                           n_pixels or len(spectrum['Pixels']))
+        pandas.DataFrame({'wvl': wvl, 'dnw': np.full(len(wvl), 0.7),
+                          'upw': np.full(len(wvl), 0.2)}).to_csv(
+                              path, index=False)
+        cal_paths.append(path)
+    return cal_paths
+
+
+def run(directory, cal_paths, repeats=3):
+    """Time each stage on a generated sequence.
+
+    Returns:
+        list of result dictionaries, one per stage
+    """
+    files = sorted(glob.glob(os.path.join(directory, '*.pico')))
+    n_bytes = sum(os.path.getsize(x) for x in files)
+    seq = read_piccolo_sequence(directory)
+    n_spectra = sum(len(d) for f in seq.values() for d in f.values())
+    corrected = RadiometricCorrection(cal_paths).transform(seq, batch=True)
+    out_dir = tempfile.mkdtemp(dir=directory)
+
+    stages = [
+        ('read', lambda: read_piccolo_sequence(directory)),
+        ('transform', lambda: RadiometricCorrection(cal_paths).transform(
+            seq)),
+        ('transform_batch', lambda: RadiometricCorrection(
+            cal_paths).transform(seq, batch=True)),
+        ('aggregate', lambda: aggregate_sequence(corrected, 'mean')),
+        ('aggregate_streaming', lambda: aggregate_sequence(
+            corrected, 'mean', streaming=True)),
+        ('calibrate', lambda: generate_calibration(seq, REFERENCE,
+                                                   'Downwelling')),
+        ('netcdf', lambda: sequence_to_netcdf(
+            corrected, os.path.join(out_dir, 'out.nc'))),
+    ]
+
+    results = []
+    for name, func in stages:
+        seconds, peak = _measure(func, repeats)
+        best = min(seconds)
+        results.append({
+            'stage': name,
+            'seconds_min': best,
+            'seconds_median': statistics.median(seconds),
+            'files_per_second': len(files) / best,
+            'spectra_per_second': n_spectra / best,
+            'input_megabytes_per_second': n_bytes / 1e6 / best,
+            'peak_memory_megabytes': peak / 1e6,
+        })
+        print('{:<22}{:>10.3f} s{:>12.1f} files/s{:>10.1f} MB peak'.format(
+            name, best, len(files) / best, peak / 1e6))
+    return results
+
+
+def compare(report, baseline, tolerance=1.2):
+    """Print the time ratio of each stage to a baseline report.
+
+    Returns:
+        list of stages slower than tolerance x the baseline
+    """
+    previous = {x['stage']: x for x in baseline['results']}
+    slower = []
+    for result in report['results']:
+        if result['stage'] not in previous:
+            continue
+        ratio = result['seconds_min'] / \
+            previous[result['stage']]['seconds_min']
+        flag = ''
+        if ratio > tolerance:
+            slower.append(result['stage'])
+            flag = '  REGRESSION'
+        print('{:<22}{:>8.2f}x baseline{}'.format(result['stage'], ratio,
+                                                   flag))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--pixels', type=int, default=None,
+                        help='pixels per spectrum (default: native)')
+    parser.add_argument('--instruments', type=int, default=2)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--baseline', default=None,
+                        help='previous report to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help='slowdown relative to the baseline that fails')
+    args = parser.parse_args(argv)
+    # missing metadata and library deprecation messages
+    logging.getLogger().setLevel(logging.ERROR)
+    warnings.simplefilter('ignore')
+
+    with tempfile.TemporaryDirectory() as directory:
+        cal_paths = generate_sequence(directory, args.files, args.pixels,
+                                      args.instruments)
+        results = run(directory, cal_paths, args.repeats)
+
+    report = {
+        'config': {
+            'files': args.files,
+            'pixels': args.pixels,
+            'instruments': args.instruments,
+            'repeats': args.repeats,
+        },
+        'environment': {
+            'created': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'piccololite': __version__,
+            'numpy': np.__version__,
+            'xarray': xarray.__version__,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(report, json.load(f), args.tolerance):
+                return 1
+    return 0
+
+
+def _measure(func, repeats):
+    # wall time of each repeat, then peak traced memory of one more call
+    # (tracing slows allocation heavy code so is kept out of the timings)
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def _serial(template_serial, k):
+    # i.e. QEP00984 -> QEP90000 for the first instrument
+    return '{}{:05d}'.format(template_serial[:-5], 90000 + k)
+
+
+def _scale_metadata(meta, n_pixels, native):
+    meta = dict(meta)
+    if n_pixels is None or n_pixels == native:
+        return meta
+    # pixel p of the new spectrum is pixel p * ratio of the template
+    ratio = (native - 1) / (n_pixels - 1)
+    meta['WavelengthCalibrationCoefficients'] = [
+        c * ratio ** i
+        for i, c in enumerate(meta['WavelengthCalibrationCoefficients'])]
+    if 'OpticalPixelRange' in meta:
+        meta['OpticalPixelRange'] = [
+            min(int(round(x / ratio)), n_pixels)
+            for x in meta['OpticalPixelRange']]
+    return meta
+
+
+def _scale_spectrum(spectrum, serial, n_pixels, time_stamp, i, rng):
+    pixels = np.asarray(spectrum['Pixels'], dtype=float)
+    native = len(pixels)
+    meta = _scale_metadata(spectrum['Metadata'], n_pixels, native)
+    if n_pixels is not None and n_pixels != native:
+        pixels = np.interp(np.linspace(0, native - 1, n_pixels),
+                           np.arange(native), pixels)
+    pixels = pixels + rng.normal(0, 2, len(pixels))
+    pixels = np.clip(np.round(pixels), 0, meta['SaturationLevel'])
+    meta['SerialNumber'] = serial
+    meta['name'] = 'S_{}'.format(serial)
+    meta['SequenceNumber'] = i
+    meta['Datetime'] = time_stamp.isoformat() + 'Z'
+    return {'Metadata': meta, 'Pixels': pixels.astype(int).tolist()}
+
+
+def _wavelengths(meta, n_pixels):
+    coefs = meta['WavelengthCalibrationCoefficients']
+    return np.polynomial.polynomial.polyval(np.arange(n_pixels), coefs)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
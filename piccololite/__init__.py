@@ -1,4 +1,15 @@
 from .correct import RadiometricCorrection
 from .io import read_piccolo_file, read_piccolo_sequence, sequence_to_datasets,\
-sequence_to_netcdf, aggregate_sequence
-from .calibrate import generate_calibration
+sequence_to_netcdf, sequence_to_zarr, sequence_to_zarr_region,\
+aggregate_sequence, SequenceReadError, SpectrumHeader,\
+PiccoloSequence
+from .calibrate import generate_calibration, generate_calibrations,\
+calibration_to_csv
+from .cache import PicoCache
+from .store import SequenceStore, sequence_to_store, open_sequence_store
+from .watch import SequenceWatcher
+from .netcdf import NetCDFWriter, sequence_to_appendable_netcdf
+from .profiling import Profiler, profile
+from .compact import CompactSpectrum, sequence_to_xarray
+from .resample import resample, resample_to_bands
+from .index import CaptureIndex
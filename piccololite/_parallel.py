@@ -0,0 +1,69 @@
+"""Helpers for running independent tasks concurrently
+"""
+import concurrent.futures
+
+
+def map_ordered(func, items, workers=None, executor=None):
+    """Apply func to every item, collecting results and errors per item.
+
+    Args:
+        func: callable taking a single item. Must be picklable if a process
+            pool is used
+        items: iterable of items
+        workers (int): number of workers. If both workers and executor are
+            None the items are processed serially in the calling thread
+        executor: 'thread', 'process' or a concurrent.futures.Executor
+            instance. Defaults to 'thread' if only workers is given
+
+    Returns:
+        list of (result, exception) tuples in the same order as items. One of
+        the pair is always None.
+    """
+    items = list(items)
+    if workers is None and executor is None:
+        return [_call(func, x) for x in items]
+
+    if isinstance(executor, concurrent.futures.Executor):
+        return _map_with(executor, func, items)
+
+    if executor in (None, 'thread'):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    elif executor == 'process':
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError('{} not a recognised executor'.format(executor))
+    with pool:
+        return _map_with(pool, func, items)
+
+
+def _map_with(pool, func, items):
+    futures = [pool.submit(func, x) for x in items]
+    out = []
+    for f in futures:
+        try:
+            out.append((f.result(), None))
+        except Exception as e:
+            out.append((None, e))
+    return out
+
+
+def _call(func, item):
+    try:
+        return (func(item), None)
+    except Exception as e:
+        return (None, e)
+
+
+def is_dask_array(x):
+    """True if x is a dask array (without importing dask)"""
+    return type(x).__module__.split('.')[0] == 'dask'
+
+
+def import_dask():
+    """Import dask.array, raising a helpful error if dask is not installed"""
+    try:
+        import dask.array
+    except ImportError:
+        raise ImportError('dask is required for out-of-core processing. '
+                          'Install with pip install dask')
+    return dask
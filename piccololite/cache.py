@@ -0,0 +1,151 @@
+"""On-disk cache of parsed Piccolo files
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import numpy as np
+
+# entries are a length prefixed json header followed by raw float64 arrays
+_DTYPE = '<f8'
+_ALIGNMENT = 8
+_SUFFIX = '.picocache'
+# seconds between updates of the last use time of an entry
+_TOUCH_INTERVAL = 3600
+
+
+class PicoCache:
+    """Binary cache of parsed .pico files.
+
+    Each file is stored as a single binary entry holding the metadata
+    followed by the raw pixel and wavelength arrays, so a warm read is one
+    file read with no text decoding of the arrays. Entries are keyed by
+    absolute path and invalidated when the size or modification time of the
+    source file changes. Once the cache exceeds max_size bytes the least
+    recently used entries are removed.
+
+    The cache can be passed to read_piccolo_file or read_piccolo_sequence
+    with the cache keyword.
+    """
+
+    def __init__(self, directory, max_size=2 * 1024 ** 3):
+        """
+        Args:
+            directory (str): directory to hold the cache (created if missing)
+            max_size (int): maximum total size of the cache in bytes
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        # kept up to date by put, so the directory is only scanned here and
+        # on eviction
+        self._size = self._get_total_size()
+
+    def get(self, fpath):
+        """Return the cached parse of fpath, or None if missing or stale.
+
+        Args:
+            fpath (str): path to a .pico file
+        """
+        key = self._get_key(fpath)
+        entry = self._get_entry_path(key[0])
+        try:
+            with open(entry, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                # writable buffer so that the arrays are not read-only
+                buffer = bytearray(stat.st_size)
+                f.readinto(buffer)
+            n_header = int.from_bytes(buffer[:8], 'little')
+            header = json.loads(buffer[8:8 + n_header].decode('utf-8'))
+            # arrays are views onto the buffer that was read
+            values = np.frombuffer(buffer, dtype=_DTYPE, offset=8 + n_header)
+        except (OSError, ValueError):
+            return None
+        if header['key'] != list(key):
+            logging.debug('stale cache entry for {}'.format(fpath))
+            return None
+
+        spectra = []
+        offset = 0
+        for metadata, n in zip(header['metadata'], header['lengths']):
+            spectra.append({'Metadata': metadata,
+                            'Pixels': values[offset:offset + n],
+                            'Wavelengths': values[offset + n:offset + 2 * n]})
+            offset += 2 * n
+        # mark as recently used for eviction. Entries are only touched
+        # once per interval so that warm reads are not metadata writes
+        if time.time() - stat.st_mtime > _TOUCH_INTERVAL:
+            os.utime(entry)
+        return {'Spectra': spectra}
+
+    def put(self, fpath, data):
+        """Store a parsed .pico file.
+
+        Args:
+            fpath (str): path to the source .pico file
+            data (dict): parsed file. Each of data['Spectra'] must have
+                Metadata, Pixels and Wavelengths
+        """
+        key = self._get_key(fpath)
+        header = {
+            'key': list(key),
+            'metadata': [x['Metadata'] for x in data['Spectra']],
+            'lengths': [len(x['Pixels']) for x in data['Spectra']]
+        }
+        header = json.dumps(header).encode('utf-8')
+        # pad so that the arrays are aligned
+        header += b' ' * (-(len(header) + 8) % _ALIGNMENT)
+
+        entry = self._get_entry_path(key[0])
+        try:
+            replaced = os.path.getsize(entry)
+        except OSError:
+            replaced = 0
+        # write then rename so that concurrent readers never see partial files
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for x in data['Spectra']:
+                f.write(np.asarray(x['Pixels'], dtype=_DTYPE).tobytes())
+                f.write(np.asarray(x['Wavelengths'], dtype=_DTYPE).tobytes())
+        os.replace(tmp, entry)
+
+        self._size += os.path.getsize(entry) - replaced
+        if self._size > self.max_size:
+            self._evict()
+
+    def clear(self):
+        """Remove all cache entries."""
+        for entry in self._list_entries():
+            os.remove(entry.path)
+        self._size = 0
+
+    def _evict(self):
+        entries = sorted(self._list_entries(),
+                         key=lambda x: x.stat().st_mtime_ns)
+        total = sum(x.stat().st_size for x in entries)
+        while entries and total > self.max_size:
+            entry = entries.pop(0)
+            total -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self._size = total
+
+    def _get_total_size(self):
+        return sum(x.stat().st_size for x in self._list_entries())
+
+    def _list_entries(self):
+        return [x for x in os.scandir(self.directory)
+                if x.name.endswith(_SUFFIX)]
+
+    def _get_entry_path(self, abspath):
+        name = hashlib.sha1(abspath.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + _SUFFIX)
+
+    def _get_key(self, fpath):
+        stat = os.stat(fpath)
+        return (os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns)
@@ -1,8 +1,13 @@
 """Routines for Piccolo calibration
 """
-from .correct import RadiometricCorrection
+from .correct import RadiometricCorrection, _CALIBRATIONS
 from .io import read_piccolo_sequence, aggregate_sequence
+from .resample import resample
+import collections.abc
 import logging
+import numpy as np
+import os
+import pandas
 import xarray
 
 def generate_calibration(piccolo_sequence, reference, direction=None):
@@ -17,16 +22,120 @@ def generate_calibration(piccolo_sequence, reference, direction=None):
     'CalibrationDirection']
 
     Args:
-        piccolo_sequence : a standard piccolo sequence, or filepath to
-            standard format directory
+        piccolo_sequence : a standard piccolo sequence (or PiccoloSequence),
+            or filepath to standard format directory
         reference : filepath to a calibration reference file in NetCDF format
         direction (optional) : Upwelling or Downwelling but can be inferred
             from reference NetCDF
     """
 
-    # Read reference files if a string
+    reference, direction = _get_reference(reference, direction)
+
+    # Read piccolo_sequence
+    if not isinstance(piccolo_sequence, collections.abc.Mapping):
+        piccolo_sequence = read_piccolo_sequence(piccolo_sequence)
+
+    # apply non linearity, integration time correction etc.
+    # and calculate mean
+    correction = RadiometricCorrection()
+    mean_seq = aggregate_sequence(correction.transform(piccolo_sequence),
+                                  'mean')
+    out = {}
+    for instr, v in mean_seq.items():
+        out[instr] = _get_coefficients(v[direction], reference, direction)
+    return out
+
+
+def generate_calibrations(calibrations, workers=None, executor=None):
+    """Calculate calibration coefficients for several sequences at once.
+
+    Each sequence is read and corrected once, however many references it is
+    used with, and only the directions that are calibrated are corrected
+    and aggregated. Where more than one sequence calibrates the same
+    instrument and direction (i.e. repeat sessions), the coefficients are
+    averaged.
+
+    Args:
+        calibrations: list of (piccolo_sequence, reference) or
+            (piccolo_sequence, reference, direction) tuples, as the arguments
+            of generate_calibration
+        workers (int): number of instrument and direction streams to
+            correct concurrently
+        executor: 'thread', 'process' or a concurrent.futures.Executor
+
+    Returns:
+        dictionary of {serial: {direction: coefficients}}
+    """
+    # references and directions needed for each distinct sequence
+    jobs = {}
+    for item in calibrations:
+        piccolo_sequence, reference = item[:2]
+        reference, direction = _get_reference(
+            reference, item[2] if len(item) > 2 else None)
+        key = piccolo_sequence if isinstance(piccolo_sequence, str) \
+            else id(piccolo_sequence)
+        jobs.setdefault(key, (piccolo_sequence, []))[1].append(
+            (reference, direction))
+
+    coefs = {}
+    for piccolo_sequence, references in jobs.values():
+        if not isinstance(piccolo_sequence, collections.abc.Mapping):
+            piccolo_sequence = read_piccolo_sequence(piccolo_sequence)
+        directions = set(d for _, d in references)
+        subset = {fname: {serial: {d: x for d, x in dirs.items()
+                                   if d in directions}
+                          for serial, dirs in f.items()}
+                  for fname, f in piccolo_sequence.items()}
+        corrected = RadiometricCorrection().transform(
+            subset, batch=True, workers=workers, executor=executor)
+        mean_seq = aggregate_sequence(corrected, 'mean', streaming=True)
+        for reference, direction in references:
+            for instr, v in mean_seq.items():
+                coefs.setdefault(instr, {}).setdefault(direction, []).append(
+                    _get_coefficients(v[direction], reference, direction))
+
+    return {instr: {d: _combine(x) for d, x in v.items()}
+            for instr, v in coefs.items()}
+
+
+def calibration_to_csv(calibrations, directory):
+    """Write calibration coefficients as RadiometricCorrection csv files.
+
+    One file is written per instrument (<serial>_CalCoeffs.csv) with wvl, dnw
+    and upw columns on the Downwelling wavelength grid. A missing direction
+    is written as NaN.
+
+    Args:
+        calibrations: dictionary of {serial: {direction: coefficients}}
+            i.e. from generate_calibrations
+        directory (str): output directory
+
+    Returns:
+        list of file paths
+    """
+    out = []
+    for instr, v in calibrations.items():
+        grid = v.get('Downwelling', v.get('Upwelling'))
+        wvl = grid['wavelength'].values
+        columns = {'wvl': wvl}
+        for col, direction in [('dnw', 'Downwelling'), ('upw', 'Upwelling')]:
+            if direction in v:
+                columns[col] = v[direction].interp(wavelength=wvl).values
+            else:
+                logging.warning('No {} calibration for {}'.format(
+                    direction, instr))
+                columns[col] = np.full(len(wvl), np.nan)
+        path = os.path.join(directory, '{}_CalCoeffs.csv'.format(instr))
+        pandas.DataFrame(columns).to_csv(path, index=False)
+        out.append(path)
+    return out
+
+
+# Private funcs
+def _get_reference(reference, direction=None):
+    # Read reference files if a string (parsed once while unchanged)
     if type(reference) is str:
-        reference = xarray.load_dataarray(reference)
+        reference = _CALIBRATIONS.load(reference, xarray.load_dataarray)
 
     # guess direction if not provided
     if not direction:
@@ -37,34 +146,35 @@ def generate_calibration(piccolo_sequence, reference, direction=None):
         else:
             raise ValueError('{} not a recognised SourceType'.format(
                 reference.attrs['SourceType']))
+    return reference, direction
 
-    # Read piccolo_sequence
-    if type(piccolo_sequence) is not dict:
-        piccolo_sequence = read_piccolo_sequence(piccolo_sequence)
 
-    # apply non linearity, integration time correction etc.
-    # and calculate mean
-    correction = RadiometricCorrection()
-    mean_seq = aggregate_sequence(correction.transform(piccolo_sequence),
-                                  'mean')
-    out = {}
-    for instr, v in mean_seq.items():
-        _measured = v[direction].fillna(1e-4)
-        # _coefs = (reference / _measured.interp_like(reference)).interp_like(_measured)
-        _coefs = (reference.interp_like(_measured) / _measured).interp_like(_measured)
+def _get_coefficients(measured, reference, direction):
+    _measured = measured.fillna(1e-4)
+    # the ratio is already on the measured grid
+    _coefs = resample(reference, _measured['wavelength']) / _measured
+
+    # Add metadata
+    _coefs.attrs = _measured.attrs
 
-        # Add metadata
-        _coefs.attrs = _measured.attrs
+    for k in ['WavelengthUnit', 'RadiometricUnit',
+              'CalibrationSourceReference']:
+        try:
+            _coefs.attrs[k] = reference.attrs[k]
+        except KeyError:
+            logging.warning('{} metadata missing from cal'.format(k))
 
-        for k in ['WavelengthUnit', 'RadiometricUnit',
-                  'CalibrationSourceReference']:
-            try:
-                _coefs.attrs[k] = reference.attrs[k]
-            except KeyError:
-                logging.warning('{} metadata missing from cal'.format(k))
+    _coefs.attrs['CalibrationDirection'] = direction
+    _coefs.attrs['Type'] = 'calibration'
+    return _coefs
 
-        _coefs.attrs['CalibrationDirection'] = direction
-        _coefs.attrs['Type'] = 'calibration'
-        out[instr] = _coefs
 
+def _combine(coefs):
+    # mean of repeat calibrations on the grid of the first
+    if len(coefs) == 1:
+        return coefs[0]
+    out = xarray.concat([x.interp_like(coefs[0]) for x in coefs],
+                        'session').mean('session')
+    out.attrs = dict(coefs[0].attrs)
+    out.attrs['CalibrationSessions'] = len(coefs)
     return out
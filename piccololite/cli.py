@@ -0,0 +1,173 @@
+"""Command line batch conversion of Piccolo run directories
+"""
+import argparse
+import functools
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+
+import netCDF4
+
+from ._parallel import map_ordered
+from .correct import RadiometricCorrection
+from .io import aggregate_sequence, read_piccolo_sequence, sequence_to_netcdf
+
+
+def convert_run(directory, output_dir, calibration_file_paths=None,
+                aggregate=None, layout='variables', batch=True, force=False):
+    """Read, correct, optionally aggregate and write a run directory.
+
+    Output files are named after the run directory
+    (<output_dir>/<run>_<serial>.nc). A run is skipped if its outputs are
+    newer than every .pico file in the run and every calibration file and
+    were written with the same options (recorded in the ConvertOptions
+    attribute of each file).
+
+    Args:
+        directory (str): directory of .pico files
+        output_dir (str): directory to write NetCDF files to
+        calibration_file_paths (list): calibration csv files
+        aggregate (str): aggregation metric. If None spectra are written
+            without aggregation
+        layout (str): dataset layout passed to sequence_to_datasets
+        batch (bool): correct spectra in batch mode
+        force (bool): convert even if the outputs are up to date
+
+    Returns:
+        dictionary of run, status, files, spectra and seconds
+    """
+    start = time.perf_counter()
+    name = os.path.basename(os.path.normpath(directory))
+    inputs = glob.glob(os.path.join(directory, '*.pico'))
+    result = {'run': directory, 'status': 'skipped', 'files': len(inputs),
+              'spectra': 0, 'seconds': 0.}
+    options = json.dumps({
+        'calibration': sorted(os.path.abspath(x)
+                              for x in calibration_file_paths or []),
+        'aggregate': aggregate, 'layout': layout, 'batch': batch},
+        sort_keys=True)
+    if not force and _up_to_date(name, output_dir,
+                                 inputs + list(calibration_file_paths or []),
+                                 options):
+        return result
+
+    seq = read_piccolo_sequence(directory)
+    corrected = RadiometricCorrection(calibration_file_paths).transform(
+        seq, batch=batch)
+    result['spectra'] = sum(len(d) for f in corrected.values()
+                            for d in f.values())
+    if aggregate is not None:
+        corrected = aggregate_sequence(corrected, aggregate, streaming=True)
+
+    # write to a temporary directory so that an interrupted run is never
+    # mistaken for an up to date one
+    tmp = os.path.join(output_dir, '.{}.{}.tmp'.format(name, os.getpid()))
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        sequence_to_netcdf(corrected, os.path.join(tmp, name + '.nc'),
+                           layout=layout)
+        for fname in os.listdir(tmp):
+            with netCDF4.Dataset(os.path.join(tmp, fname), 'a') as nc:
+                nc.setncattr('ConvertOptions', options)
+        for fname in os.listdir(tmp):
+            os.replace(os.path.join(tmp, fname),
+                       os.path.join(output_dir, fname))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    result['status'] = 'converted'
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    """Entry point of the piccololite-convert command"""
+    parser = argparse.ArgumentParser(
+        description='Correct Piccolo run directories and write NetCDF')
+    parser.add_argument('runs', nargs='+', help='run directories')
+    parser.add_argument('-c', '--calibration', nargs='*', default=None,
+                        help='calibration csv files (i.e. '
+                        'FLMS01691_CalCoeffs.csv)')
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help='output directory')
+    parser.add_argument('-a', '--aggregate', default=None,
+                        help='aggregate repeats (mean, median, min, max, '
+                        'std or var)')
+    parser.add_argument('--layout', default='variables',
+                        choices=['variables', 'capture'])
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of runs processed in parallel '
+                        '(default: number of CPUs)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='convert runs even if outputs are up to date')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.ERROR,
+        format='%(levelname)s: %(message)s')
+
+    # outputs are named after the run directory, so runs of the same name
+    # would overwrite each other
+    names = [os.path.basename(os.path.normpath(x)) for x in args.runs]
+    duplicates = sorted(set(x for x in names if names.count(x) > 1))
+    if duplicates:
+        parser.error('run directories must have unique names: {}'.format(
+            ', '.join(duplicates)))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    task = functools.partial(
+        convert_run, output_dir=args.output_dir,
+        calibration_file_paths=args.calibration, aggregate=args.aggregate,
+        layout=args.layout, force=args.force)
+    workers = args.workers or os.cpu_count()
+    executor = 'process' if workers > 1 and len(args.runs) > 1 else None
+
+    start = time.perf_counter()
+    results = map_ordered(task, args.runs, workers, executor)
+    elapsed = time.perf_counter() - start
+
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    files = spectra = 0
+    for run, (result, error) in zip(args.runs, results):
+        if error is not None:
+            counts['failed'] += 1
+            print('{}: failed ({})'.format(run, error), file=sys.stderr)
+            continue
+        counts[result['status']] += 1
+        if result['status'] == 'converted':
+            files += result['files']
+            spectra += result['spectra']
+            logging.info('{}: {} files in {:.2f} s'.format(
+                run, result['files'], result['seconds']))
+
+    print('{converted} converted, {skipped} up to date, {failed} failed'
+          .format(**counts))
+    print('{} files ({} spectra) in {:.2f} s: {:.1f} files/s, '
+          '{:.1f} spectra/s'.format(files, spectra, elapsed,
+                                    files / elapsed, spectra / elapsed))
+    return 1 if counts['failed'] else 0
+
+
+def _up_to_date(name, output_dir, inputs, options):
+    # <run>_<serial>.nc, not the outputs of a run named <run>_<suffix>
+    pattern = re.compile(r'^{}_[^_]+\.nc$'.format(re.escape(name)))
+    outputs = [os.path.join(output_dir, x) for x in os.listdir(output_dir)
+               if pattern.match(x)]
+    if not outputs or not inputs:
+        return False
+    for x in outputs:
+        with netCDF4.Dataset(x) as nc:
+            if getattr(nc, 'ConvertOptions', None) != options:
+                return False
+    newest_input = max(os.path.getmtime(x) for x in inputs)
+    return min(os.path.getmtime(x) for x in outputs) >= newest_input
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""Compact in-memory representation of Piccolo spectra
+"""
+import itertools
+import weakref
+
+import numpy as np
+import xarray
+
+# metadata that varies between captures. Everything else describes the
+# instrument and is shared between spectra
+_CAPTURE_KEYS = frozenset([
+    'Batch', 'Dark', 'DarkPixels', 'Datetime', 'IntegrationTime',
+    'SequenceNumber', 'SourceFilePath', 'Type'])
+
+_INSTRUMENTS = weakref.WeakValueDictionary()
+_IDS = itertools.count()
+
+
+class Instrument:
+    """Metadata shared by the spectra of an instrument and direction.
+
+    Instruments are interned: every spectrum with the same instrument
+    metadata and pixel count references the same Instrument, so coefficient
+    lists and the wavelength grid are held once.
+
+    Attributes:
+        id (int): identifier, unique within the process
+        metadata (dict): instrument metadata (i.e. SerialNumber, Direction and
+            calibration coefficients). Must not be modified
+        keys (tuple): order of all metadata keys of the spectra
+        wavelength: read-only wavelength of each pixel
+        pixel: read-only pixel index
+    """
+    __slots__ = ('id', 'metadata', 'keys', 'wavelength', 'pixel',
+                 '__weakref__')
+
+    def __init__(self, metadata, keys, wavelength):
+        self.id = next(_IDS)
+        self.metadata = metadata
+        self.keys = keys
+        self.wavelength = wavelength
+        self.pixel = np.arange(len(wavelength))
+        self.wavelength.flags.writeable = False
+        self.pixel.flags.writeable = False
+
+
+class CompactSpectrum:
+    """A spectrum held as raw counts and a reference to its instrument.
+
+    Counts are stored as uint32 when they are non-negative integers (the
+    usual case) and otherwise as float32 or float64, whichever is lossless.
+    Only metadata that varies between captures is held per spectrum.
+
+    The attrs, data and values attributes mirror a DataArray, so compact
+    spectra can be corrected with RadiometricCorrection. Use to_xarray (or
+    sequence_to_xarray) to convert to the DataArray read_piccolo_file returns.
+
+    Attributes:
+        counts: 1-D array of counts
+        instrument (Instrument): shared instrument metadata
+        metadata (dict): capture metadata (i.e. Datetime, IntegrationTime)
+    """
+    __slots__ = ('counts', 'instrument', 'metadata')
+
+    def __init__(self, counts, instrument, metadata):
+        self.counts = counts
+        self.instrument = instrument
+        self.metadata = metadata
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        return '<CompactSpectrum {} {} ({} pixels)>'.format(
+            self.instrument.metadata.get('SerialNumber'),
+            self.instrument.metadata.get('Direction'), len(self.counts))
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    @property
+    def data(self):
+        return self.counts
+
+    @property
+    def values(self):
+        return self.counts
+
+    @property
+    def attrs(self):
+        """A new dictionary of all metadata, in file order"""
+        capture = self.metadata
+        instrument = self.instrument.metadata
+        return {k: capture[k] if k in capture else instrument[k]
+                for k in self.instrument.keys}
+
+    def to_xarray(self):
+        """Returns the spectrum as a DataArray with a wavelength dimension"""
+        return xarray.DataArray(
+            self.counts.astype(float), dims='wavelength',
+            coords={'wavelength': ('wavelength', self.instrument.wavelength),
+                    'pixel': ('wavelength', self.instrument.pixel)},
+            attrs=self.attrs)
+
+
+def make_compact_spectrum(metadata, pixels, wavelength=None):
+    """Create a CompactSpectrum from a parsed .pico reading.
+
+    Args:
+        metadata (dict): the full metadata of the reading
+        pixels: counts
+        wavelength: wavelength of each pixel, if already evaluated
+
+    Returns:
+        CompactSpectrum
+    """
+    counts = _compact_counts(pixels)
+    capture = {}
+    instrument = {}
+    for k, v in metadata.items():
+        if k in _CAPTURE_KEYS or ('Temperature' in k and
+                                  not isinstance(v, str)):
+            capture[k] = v
+        else:
+            instrument[k] = v
+    return CompactSpectrum(
+        counts, get_instrument(instrument, tuple(metadata), len(counts),
+                               wavelength),
+        capture)
+
+
+def get_instrument(metadata, keys, n_pixels, wavelength=None):
+    """Returns the interned Instrument of instrument metadata.
+
+    Args:
+        metadata (dict): instrument metadata
+        keys (tuple): order of the metadata keys of the spectra
+        n_pixels (int): number of pixels
+        wavelength: wavelength of each pixel. Evaluated from the
+            WavelengthCalibrationCoefficients if None
+    """
+    key = (_freeze(metadata), keys, n_pixels)
+    instrument = _INSTRUMENTS.get(key)
+    if instrument is None:
+        if wavelength is None:
+            wavelength = _evaluate_wavelengths(
+                metadata['WavelengthCalibrationCoefficients'], n_pixels)
+        instrument = Instrument(metadata, keys,
+                                np.array(wavelength, dtype=float))
+        _INSTRUMENTS[key] = instrument
+    return instrument
+
+
+def as_dataarray(spectrum):
+    """Returns spectrum as a DataArray (converting a CompactSpectrum)"""
+    if isinstance(spectrum, CompactSpectrum):
+        return spectrum.to_xarray()
+    return spectrum
+
+
+def sequence_to_xarray(piccolo_sequence):
+    """Converts the compact spectra of a sequence to DataArrays.
+
+    Sequences of DataArrays are returned unchanged.
+
+    Args:
+        piccolo_sequence: nested dictionary of piccolo spectra
+
+    Returns:
+        nested dictionary of DataArrays
+    """
+    if not _is_compact(piccolo_sequence):
+        return piccolo_sequence
+    return {fname: {serial: {d: as_dataarray(x) for d, x in dirs.items()}
+                    for serial, dirs in f.items()}
+            for fname, f in piccolo_sequence.items()}
+
+
+# Private funcs
+def _is_compact(piccolo_sequence):
+    for f in piccolo_sequence.values():
+        for directions in f.values():
+            for x in directions.values():
+                if x is not None:
+                    return isinstance(x, CompactSpectrum)
+    return False
+
+
+def _compact_counts(pixels):
+    x = np.asarray(pixels)
+    if x.size and x.dtype.kind in 'iuf' and np.isfinite(x).all() and \
+            x.min() >= 0 and x.max() < 2 ** 32 and \
+            (x.dtype.kind != 'f' or np.array_equal(x, np.round(x))):
+        return x.astype(np.uint32)
+    x = x.astype(float)
+    single = x.astype(np.float32)
+    if np.array_equal(single, x, equal_nan=True):
+        return single
+    return x
+
+
+def _freeze(value):
+    # hashable copy of nested metadata
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_freeze(v) for v in value)
+    # keep i.e. True, 1 and 1.0 apart
+    return (type(value), value)
+
+
+def _evaluate_wavelengths(coefs, n_pixels):
+    wpoly = np.poly1d(np.array(coefs)[::-1])
+    return wpoly(np.arange(n_pixels))
@@ -1,13 +1,21 @@
 """Radiometric Correction
 """
 import datetime
+import functools
 import os
 import pandas
+import threading
 import xarray
 import numpy as np
 import logging
+import warnings
 
+from . import nonlinearity, profiling
+from ._parallel import import_dask, is_dask_array, map_ordered
 from ._version import __version__
+from .compact import as_dataarray
+from .resample import get_resampler
+from .store import _to_datetime
 # logging.basicConfig(level=logging.DEBUG)
 
 class RadiometricCorrection:
@@ -25,11 +33,19 @@ class RadiometricCorrection:
     first dark file will be used. Pixels that reach the SaturationLevel of the
     device are masked for this.
 
+    Alternatively a per-pixel dark model can be used (dark_model='mean' or
+    'interpolate'). This averages every dark file per pixel or, to follow
+    temperature drift over long runs, interpolates per-pixel darks linearly in
+    time between the dark files either side of each capture.
+
     ### 2. Non Linearity Correction
 
     Correct for non linearity across the dynamic range of the sensor
         corrected = dark + (raw - dark) / f(raw - dark)
-    where f is a polynomial specified in the header
+    where f is a polynomial specified in the header. Batches are corrected in
+    place with Horner's scheme. As raw counts are integers bounded by the
+    SaturationLevel, non_linearity_lut=True instead looks up the correction of
+    every count in a precomputed table when the dark signal is constant
 
     ### 3. Dark Signal Subtraction
 
@@ -56,7 +72,9 @@ class RadiometricCorrection:
     def __init__(self, calibration_file_paths=None, dark_reference=None,
                  correct_non_linearity=True, trim_optical_range=True,
                  correct_dark_signal=True, correct_integration_time=True,
-                 correct_bandwidth=True, correct_gain=True):
+                 correct_bandwidth=True, correct_gain=True,
+                 dark_model='scalar', non_linearity_lut=False,
+                 dtype=np.float64):
         """
         Args:
             calibration_file_paths (list): a list of filepaths with the serial
@@ -72,12 +90,23 @@ class RadiometricCorrection:
             correct_gain (bool): apply gain multiplier (note this requires
                 calibration_file_paths to be specified)
             correct_bandwidth (bool): divide by bandwidth
+            dark_model (str): 'scalar' to use the mean of the dark reference
+                file, 'mean' for the per-pixel mean of all dark files or
+                'interpolate' for per-pixel darks interpolated linearly in
+                time (Datetime) between dark files
+            non_linearity_lut (bool): correct integer counts with a lookup
+                table of every count up to the SaturationLevel (batch mode
+                only). Falls back to Horner evaluation for non integer counts
+                or per-pixel dark models
+            dtype: float dtype of batch processing and output (np.float64 or
+                np.float32)
 
         Note: if cal_file_paths is not provided, no gain correction is made, so
         your data will be corrected DNs (rather than a radiometric unit)
 
         """
         self._cal_coefs = {}
+        self._plans = {}
         self.dark_reference = None
         self._dark_reference_file = dark_reference
         # flags defining which processing is applied
@@ -87,23 +116,61 @@ class RadiometricCorrection:
         self._do_correct_int_time = correct_integration_time
         self._do_correct_gain = correct_gain
         self._do_bandwidth_scaling = correct_bandwidth
+        if dark_model not in ('scalar', 'mean', 'interpolate'):
+            raise ValueError('{} not a recognised dark_model'.format(
+                dark_model))
+        self._dark_model = dark_model
+        self._non_linearity_lut = non_linearity_lut
+        if np.dtype(dtype).kind != 'f':
+            raise ValueError('{} not a float dtype'.format(dtype))
+        self._dtype = np.dtype(dtype)
 
         if calibration_file_paths is not None:
             for c in calibration_file_paths:
                 serial = self._get_serial(c)
-                self._cal_coefs[serial] = self._load_calibration(c)
+                self._cal_coefs[serial] = _CALIBRATIONS.load(
+                    c, self._load_calibration)
 
         else:
             logging.warning('No calibration file provided. Final radiometric correction will not be made')
             self._do_correct_gain = False
 
-    def transform(self, piccolo_sequence):
+    def transform(self, piccolo_sequence, batch=False, workers=None,
+                  executor=None):
         """Apply calibration transform
 
         Args:
             piccolo_sequence: open data files
+            batch (bool): if True, spectra sharing an instrument and direction
+                are stacked into a single (capture, pixel) array and corrected
+                together. Results are identical to the default per-spectrum
+                path but avoid per-spectrum xarray overhead on long sequences
+            workers (int): number of instrument and direction streams to
+                correct concurrently. By default streams are corrected one
+                after another
+            executor: 'thread', 'process' or a concurrent.futures.Executor.
+                Threads suit in-memory sequences as numpy releases the GIL
         """
         self.set_dark_reference(piccolo_sequence, self._dark_reference_file)
+        return self.apply(piccolo_sequence, batch, workers, executor)
+
+    def apply(self, piccolo_sequence, batch=False, workers=None,
+              executor=None):
+        """Apply calibration transform using the current dark reference
+
+        Unlike transform, the dark reference is not reset from the sequence,
+        so a sequence without dark files can be corrected after
+        set_dark_reference has been called.
+
+        Args:
+            piccolo_sequence: open data files
+            batch (bool): stack spectra sharing an instrument and direction
+            workers (int): number of streams to correct concurrently
+            executor: 'thread', 'process' or a concurrent.futures.Executor
+        """
+        if batch or workers is not None or executor is not None:
+            return self._transform_streams(piccolo_sequence, batch, workers,
+                                           executor)
 
         out = {}
         # iterate filename
@@ -132,14 +199,20 @@ class RadiometricCorrection:
     def get_dark_signal(self, spectrum):
         """Returns the dark signal
 
+        This is a float, or a per-pixel array if a per-pixel dark model is
+        used.
+
         Args:
             spectrum: DataArray with Direction and name parameters
         """
         if self.dark_reference:
             direction = spectrum.attrs['Direction']
             serial = spectrum.attrs['SerialNumber']
+            dark = self.dark_reference[serial][direction]
+            if isinstance(dark, _DarkModel):
+                return dark.get([spectrum])[0]
             # just take the mean across all regions
-            return self.dark_reference[serial][direction]
+            return dark
         else:
             # fallback to instrument optical dark pixels
             return spectrum.attrs['DarkSignal']
@@ -147,7 +220,8 @@ class RadiometricCorrection:
     def set_dark_reference(self, piccolo_sequence, key=None):
         """Loads the dark reference from a piccolo_sequence.
 
-        By default the first file is used, unless key specified.
+        By default the first file is used (or every dark file with a
+        per-pixel dark model), unless key specified.
 
         Args:
             piccolo_sequence: A piccolo sequence dictionary
@@ -155,20 +229,27 @@ class RadiometricCorrection:
         """
         # find correct loaded pico file
         if not key:
-            key = [x for x in piccolo_sequence.keys() if '_dark' in x]
-            if len(key) < 1:
+            keys = [x for x in piccolo_sequence.keys() if '_dark' in x]
+            if len(keys) < 1:
                 raise ValueError('No dark signal file found')
-            key = key[0]
+        else:
+            keys = [key]
+
+        for key in keys:
+            if key not in piccolo_sequence:
+                raise ValueError('{} not in piccolo_sequence'.format(key))
 
-        if key not in piccolo_sequence:
-            raise ValueError('{} not in piccolo_sequence'.format(key))
+        if self._dark_model != 'scalar':
+            self.dark_reference = self._fit_dark_models(
+                [piccolo_sequence[k] for k in keys])
+            return
 
-        f = piccolo_sequence[key]
+        f = piccolo_sequence[keys[0]]
         out = {}
         for serial in f.keys():
             _sub = {}
             for _dir in f[serial].keys():
-                arr = f[serial][_dir]
+                arr = as_dataarray(f[serial][_dir])
                 sat_lvl = arr.attrs['SaturationLevel']
                 direction = arr.attrs['Direction']
                 # trim and mask out saturated
@@ -179,51 +260,213 @@ class RadiometricCorrection:
             out[serial] = _sub
         self.dark_reference = out
 
+    def _fit_dark_models(self, files):
+        spectra = {}
+        for f in files:
+            for serial in f.keys():
+                for _dir in f[serial].keys():
+                    arr = f[serial][_dir]
+                    spectra.setdefault(serial, {}).setdefault(
+                        arr.attrs['Direction'], []).append(arr)
+        interpolate = self._dark_model == 'interpolate'
+        return {serial: {d: _DarkModel(x, interpolate) for d, x in v.items()}
+                for serial, v in spectra.items()}
+
+    def _get_dark_stack(self, spectra):
+        # (capture, pixel) dark signal of spectra sharing a correction plan,
+        # and the dark signal reported in the metadata of each
+        first = spectra[0]
+        model = None
+        if self.dark_reference:
+            model = self.dark_reference[first.attrs['SerialNumber']][
+                first.attrs['Direction']]
+        if not isinstance(model, _DarkModel):
+            dark_signal = [self.get_dark_signal(da) for da in spectra]
+            return np.array(dark_signal, dtype=float)[:, np.newaxis], \
+                dark_signal
+        dark = model.get(spectra)
+        pixels = slice(None)
+        if self._do_optical_range_trim:
+            pixels = slice(*self._get_optical_pixel_range(first))
+        return dark, dark[:, pixels].mean(axis=1).tolist()
+
     def _transform_single(self, da):
-        # Get parameters
-        dark_signal = self.get_dark_signal(da)
-        # make an xarray copy
-        x = da.copy()
+        return self._transform_stack([da])[0]
+
+    def _transform_streams(self, piccolo_sequence, batch, workers=None,
+                           executor=None):
+        # spectra are grouped by correction plan (batch) or by instrument and
+        # direction, and the independent groups corrected concurrently.
+        # preserve the nested output structure and ordering of transform
+        out = {}
+        groups = {}
+        for filename in piccolo_sequence.keys():
+            out[filename] = {}
+            for serial in piccolo_sequence[filename].keys():
+                out[filename][serial] = {}
+                for _dir in piccolo_sequence[filename][serial].keys():
+                    da = piccolo_sequence[filename][serial][_dir]
+                    out[filename][serial][_dir] = None
+                    key = self._get_plan_key(da) if batch else (serial, _dir)
+                    groups.setdefault(key, []).append(
+                        (filename, serial, _dir, da))
+
+        task = functools.partial(_correct_group, self, batch)
+        results = map_ordered(task, [[m[3] for m in members]
+                                     for members in groups.values()],
+                              workers, executor)
+        for members, (arrays, error) in zip(groups.values(), results):
+            if error is not None:
+                raise error
+            for (filename, serial, _dir, _), x in zip(members, arrays):
+                out[filename][serial][_dir] = x
+        return out
+
+    def _transform_stack(self, spectra):
+        # Correct a list of 1-D spectra sharing a correction plan as one
+        # (capture, pixel) array
+        # stage timings are only recorded if profiling hooks are registered
+        timed = profiling.enabled()
+        if timed:
+            t = profiling.clock()
+            info = {'serial': spectra[0].attrs['SerialNumber'],
+                    'direction': spectra[0].attrs['Direction']}
+        first = spectra[0]
+        plan = self._get_plan(first)
+        dark, dark_signal = self._get_dark_stack(spectra)
+        raw = _stack([da.data for da in spectra])
+        x = raw.astype(self._dtype)
+        if timed:
+            t = profiling.record('prepare', t, x, **info)
+        # intermediate means are only computed if they will be logged (and
+        # never for lazy dask arrays)
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG) and \
+            not is_dask_array(x)
+        logging.debug('correcting {} spectra of {} {}'.format(
+            x.shape[0], first.attrs['SerialNumber'], first.attrs['Direction']))
+
         # non linearity correction
-        if self._do_non_linearity_correction:
-            x = self._correct_non_linearity(x, dark_signal)
-            logging.debug('post linearity correct mean: {}'.format(
-                x.mean().values))
+        if plan.nonlinearity is not None:
+            x = self._correct_non_linearity_stack(x, raw, dark, plan, first)
+            if debug:
+                logging.debug('post linearity correct mean: {}'.format(
+                    x.mean()))
+            if timed:
+                t = profiling.record('non_linearity', t, x, **info)
         # Trim to internally specified optical range
-        if self._do_optical_range_trim:
-            x = self._trim_to_optical_range(x)
-            logging.debug('post optic range trim mean: {}'.format(
-                x.mean().values))
+        x = x[:, plan.pixels]
+        if dark.shape[1] > 1:
+            dark = dark[:, plan.pixels]
+        if timed:
+            t = profiling.record('trim', t, x, **info)
         # dark signal subtraction - note that this is reliant on dark signal
         # integration time being equal to measured signal integration time
         if self._do_correct_ds:
-            x = x - dark_signal
-            logging.debug('post DS subtraction mean: {}'.format(
-                x.mean().values))
+            x = _apply(np.subtract, x, dark)
+            if debug:
+                logging.debug('post DS subtraction mean: {}'.format(x.mean()))
+            if timed:
+                t = profiling.record('dark', t, x, **info)
         # integration time normalisation
         if self._do_correct_int_time:
-            x = x / self._get_integration_time_s(da)
+            int_time = np.array([self._get_integration_time_s(da)
+                                 for da in spectra])
+            x = _apply(np.divide, x, int_time[:, np.newaxis])
+            if timed:
+                t = profiling.record('integration', t, x, **info)
+        # bandwidth and gain
+        if plan.scale is not None:
+            x = _apply(np.multiply, x, plan.scale)
+            if debug:
+                logging.debug('post gain mean: {}'.format(x.mean()))
+            if timed:
+                t = profiling.record('bandwidth_gain', t, x, **info)
+
+        out = []
+        for da, row, ds in zip(spectra, x, dark_signal):
+            arr = xarray.DataArray(row, coords=plan.coords, dims='wavelength',
+                                   attrs=da.attrs)
+            self._add_correction_metadata(arr, plan.calibration, ds)
+            out.append(arr)
+        if timed:
+            profiling.record('output', t, **info)
+        return out
+
+    def _correct_non_linearity_stack(self, x, raw, dark, plan, first):
+        # x is a new array, so numpy batches are corrected in place
+        if is_dask_array(x):
+            return dark + (x - dark) / _polyval(plan.nonlinearity, x - dark)
+        if self._non_linearity_lut:
+            corrected = nonlinearity.lookup_non_linearity(
+                raw, plan.nonlinearity, dark, first.attrs['SaturationLevel'],
+                x.dtype)
+            if corrected is not None:
+                return corrected
+        return nonlinearity.correct_non_linearity(x, plan.nonlinearity, dark)
+
+    def _get_plan(self, da):
+        # spectrum independent parameters are computed once per instrument,
+        # direction and wavelength grid and reused across transforms
+        key = self._get_plan_key(da)
+        try:
+            return self._plans[key]
+        except KeyError:
+            pass
+        # plans are built from DataArrays
+        da = as_dataarray(da)
+
+        coefs = None
+        if self._do_non_linearity_correction:
+            coefs = np.array(
+                da.attrs['NonlinearityCorrectionCoefficients'], dtype=float)
+
+        pixels = slice(None)
+        template = da
+        if self._do_optical_range_trim:
+            pixels = slice(*self._get_optical_pixel_range(da))
+            template = self._trim_to_optical_range(da)
 
+        scale = None
         if self._do_bandwidth_scaling:
-            x = x / self._get_band_width(x)
+            scale = 1 / self._get_band_width(template)
 
+        calibration = None
         if self._do_correct_gain:
             calibration = self.get_calibration(da)
-            x = calibration.interp_like(x, method='linear') * x
-            logging.debug('post gain mean: {}'.format(x.mean().values))
-        # add metadata again
-        x.attrs = da.attrs
-        # add additional metadata
-        try:
+            gain = _CALIBRATIONS.get_gain(calibration, template)
+            scale = gain if scale is None else gain * scale
+
+        plan = _CorrectionPlan(coefs, pixels, template.coords, scale,
+                               calibration)
+        self._plans[key] = plan
+        return plan
+
+    def _get_plan_key(self, da):
+        # everything a plan depends on besides the processing flags
+        def _freeze(key):
+            value = da.attrs.get(key)
+            if value is None:
+                return None
+            return tuple(np.atleast_1d(value).tolist())
+        calibration = None
+        if self._do_correct_gain:
+            calibration = self.get_calibration(da).attrs['SourceFilePath']
+        return (da.attrs['SerialNumber'], da.attrs['Direction'], len(da),
+                _freeze('WavelengthCalibrationCoefficients'),
+                _freeze('OpticalPixelRange'),
+                _freeze('NonlinearityCorrectionCoefficients'),
+                calibration)
+
+    def _add_correction_metadata(self, x, calibration, dark_signal):
+        if calibration is not None:
             x.attrs['CalibrationFilePath'] = calibration.attrs['SourceFilePath']
-        except UnboundLocalError:
+        else:
             x.attrs['CalibrationFilePath'] = 'None'
         x.attrs['DarkSignal'] = dark_signal
         x.attrs['RadiometricCorrectionCompleteUTC'] = \
             datetime.datetime.utcnow().isoformat()
         x.attrs['RadiometricCorrectionVersion'] = 'piccololite_v{}'.format(
             __version__)
-        return x
 
     def _get_band_width(self, x):
         delta = x.wavelength.diff('wavelength') / 2
@@ -292,3 +535,177 @@ class RadiometricCorrection:
         corrected = dark + (dataArray - dark) / cpoly(dataArray - dark)
         corrected.attrs = dataArray.attrs
         return corrected
+
+
+class _CalibrationRegistry:
+    """Process-wide cache of parsed calibration files.
+
+    Files are keyed by absolute path and modification time, so a file is
+    only parsed again if it changes. Gains resampled onto each wavelength grid
+    are stored alongside, so new RadiometricCorrection instances need no file
+    I/O or interpolation.
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def load(self, fpath, loader):
+        """Returns loader(fpath), parsing the file only if it has changed"""
+        path = os.path.abspath(fpath)
+        mtime = os.stat(path).st_mtime_ns
+        entry = self._files.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        value = loader(fpath)
+        with self._lock:
+            self._files[path] = (mtime, value, {})
+        return value
+
+    def get_gain(self, calibration, template):
+        """Returns calibration resampled onto the wavelengths of template"""
+        entry = self._files.get(calibration.attrs.get('SourceFilePath'))
+        wavelength = np.asarray(template['wavelength'].values)
+        if entry is None or not any(x is calibration
+                                    for x in _values(entry[1])):
+            # not loaded through the registry (or since replaced)
+            return _resample_gain(calibration, wavelength)
+        key = (id(calibration), wavelength.tobytes())
+        try:
+            return entry[2][key]
+        except KeyError:
+            pass
+        gain = _resample_gain(calibration, wavelength)
+        # shared between correctors
+        gain.flags.writeable = False
+        with self._lock:
+            entry[2][key] = gain
+        return gain
+
+    def clear(self):
+        """Remove all cached files and gains"""
+        with self._lock:
+            self._files.clear()
+
+
+_CALIBRATIONS = _CalibrationRegistry()
+
+
+def _values(x):
+    return x.values() if isinstance(x, dict) else [x]
+
+
+def _resample_gain(calibration, wavelength):
+    return get_resampler(calibration['wavelength'].values, wavelength)(
+        calibration.values)
+
+
+class _CorrectionPlan:
+    """Spectrum independent correction parameters.
+
+    Attributes:
+        nonlinearity: non linearity coefficients (increasing powers) or None
+        pixels: slice of the optical pixel range
+        coords: wavelength coordinates of the corrected spectrum
+        scale: gain / bandwidth vector applied to the corrected spectrum
+        calibration: calibration DataArray or None
+    """
+
+    def __init__(self, nonlinearity, pixels, coords, scale, calibration):
+        self.nonlinearity = nonlinearity
+        self.pixels = pixels
+        self.coords = coords
+        self.scale = scale
+        self.calibration = calibration
+
+
+class _DarkModel:
+    """Per-pixel dark signal of an instrument and direction.
+
+    Saturated pixels of each dark spectrum are replaced by the per-pixel mean
+    of the other dark spectra, so all arrays are computed once when the model
+    is created and the dark of a stack of captures is a single vectorized
+    interpolation.
+
+    Attributes:
+        times: sorted dark capture times (datetime64) or None
+        darks: (dark, pixel) array of dark spectra in time order
+        mean: per-pixel mean of the dark spectra
+    """
+
+    def __init__(self, spectra, interpolate=False):
+        """
+        Args:
+            spectra: list of dark DataArrays of the same length
+            interpolate (bool): interpolate linearly in time between dark
+                spectra. Otherwise the mean is used for every capture
+        """
+        if len(set(len(da) for da in spectra)) > 1:
+            raise ValueError('Dark spectra must have the same number of '
+                             'pixels')
+        x = np.stack([np.asarray(da.values, dtype=float) for da in spectra])
+        saturation = np.array([da.attrs['SaturationLevel']
+                               for da in spectra], dtype=float)
+        x[x >= saturation[:, np.newaxis]] = np.nan
+        with warnings.catch_warnings():
+            # pixels saturated in every dark
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(x, axis=0)
+            mean[np.isnan(mean)] = np.nanmean(mean)
+        self.mean = mean
+        self.times = None
+        self.darks = None
+        if interpolate and len(spectra) > 1:
+            times = _to_datetime([da.attrs['Datetime'] for da in spectra])
+            order = np.argsort(times, kind='stable')
+            self.times = times[order]
+            self.darks = np.where(np.isnan(x), mean, x)[order]
+
+    def get(self, spectra):
+        """Returns the (capture, pixel) dark signal of a list of spectra"""
+        if any(len(da) != len(self.mean) for da in spectra):
+            raise ValueError('Spectra and dark reference have a different '
+                             'number of pixels')
+        if self.times is None:
+            return np.broadcast_to(self.mean, (len(spectra), len(self.mean)))
+        times = _to_datetime([da.attrs['Datetime'] for da in spectra])
+        # seconds since the first dark, clamped to the range of the darks
+        t = (times - self.times[0]) / np.timedelta64(1, 's')
+        known = (self.times - self.times[0]) / np.timedelta64(1, 's')
+        i = np.clip(np.searchsorted(known, t, side='right'), 1,
+                    len(known) - 1)
+        span = known[i] - known[i - 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.clip(np.where(span > 0, (t - known[i - 1]) / span, 0),
+                        0, 1)[:, np.newaxis]
+        return self.darks[i - 1] * (1 - w) + self.darks[i] * w
+
+
+def _correct_group(correction, batch, spectra):
+    # module level so that it can be sent to a process pool
+    if batch:
+        return correction._transform_stack(spectra)
+    return [correction._transform_single(da) for da in spectra]
+
+
+def _polyval(coefs, x):
+    # Horner evaluation of coefficients in increasing power order. Unlike
+    # np.poly1d this keeps dask arrays lazy
+    y = coefs[-1]
+    for c in coefs[-2::-1]:
+        y = y * x + c
+    return y
+
+
+def _apply(ufunc, x, y):
+    # in place for numpy arrays, which also keeps float32 batches float32
+    if is_dask_array(x):
+        return ufunc(x, y)
+    return ufunc(x, y, out=x)
+
+
+def _stack(arrays):
+    # stack numpy or dask arrays along a new first axis
+    if any(is_dask_array(x) for x in arrays):
+        return import_dask().array.stack(arrays)
+    return np.stack(arrays)
@@ -0,0 +1,237 @@
+"""Persistent index of the captures in a directory of .pico files
+"""
+import logging
+import os
+
+import numpy as np
+import pandas
+
+from ._parallel import map_ordered
+from .io import read_piccolo_file, read_piccolo_sequence, _index_files
+from .store import _to_datetime
+
+# written next to the .pico files
+INDEX_NAME = '.piccololite_index.csv'
+
+# metadata of each capture held in the index
+_METADATA = ['SerialNumber', 'Direction', 'Datetime', 'Run',
+             'IntegrationTime', 'Dark', 'TemperatureDetectorActual']
+_COLUMNS = ['Filename', 'Batch', 'SequenceNumber', 'Type'] + _METADATA + \
+    ['Size', 'MTime']
+
+
+class CaptureIndex:
+    """Index of every spectrum in a directory of .pico files.
+
+    Each capture (one spectrum of a file) is a row of Filename, Batch,
+    SequenceNumber and Type (parsed from the filename) and SerialNumber,
+    Direction, Datetime, Run, IntegrationTime, Dark and
+    TemperatureDetectorActual (from the file metadata). Files are read with
+    metadata_only=True, so pixels are never decoded. The index is persisted
+    to INDEX_NAME in the directory, and updating it only reads files that are
+    new or have changed size or modification time since they were indexed.
+
+    Example:
+        index = CaptureIndex(directory)
+        captures = index.query(serial='QEP00984', type='light',
+                               start='2020-05-30 12:00',
+                               end='2020-05-30 13:00', integration_time=10)
+        seq = index.load(captures)
+
+    Attributes:
+        directory (str): directory of .pico files
+        captures (pandas.DataFrame): one row per capture
+    """
+
+    def __init__(self, directory, update=True, persist=True, workers=None,
+                 executor=None):
+        """
+        Args:
+            directory (str): directory of .pico files
+            update (bool): index new and changed files now. If False the
+                persisted index is used as it is
+            persist (bool): write the index to the directory when it changes
+            workers (int): number of files to index concurrently
+            executor: 'thread', 'process' or a concurrent.futures.Executor
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_NAME)
+        self.persist = persist
+        self.workers = workers
+        self.executor = executor
+        self.captures = self._load()
+        if update:
+            self.update()
+
+    def __len__(self):
+        return len(self.captures)
+
+    def __repr__(self):
+        return '<CaptureIndex: {} captures in {} files>'.format(
+            len(self), self.captures['Filename'].nunique())
+
+    def update(self):
+        """Index new and changed files and drop files that were removed.
+
+        Files that cannot be read (i.e. are still being written) are left
+        out and retried on the next update.
+
+        Returns:
+            number of files indexed
+        """
+        listing = {x.name: x.stat() for x in os.scandir(self.directory)
+                   if x.name.endswith('.pico')}
+        indexed = self.captures.drop_duplicates('Filename').set_index(
+            'Filename')
+        current = [fname for fname, stat in listing.items()
+                   if fname in indexed.index and
+                   indexed.loc[fname, 'Size'] == stat.st_size and
+                   indexed.loc[fname, 'MTime'] == stat.st_mtime_ns]
+        stale = sorted(set(listing) - set(current))
+        removed = set(indexed.index) - set(listing)
+        if not stale and not removed:
+            return 0
+
+        paths = [os.path.join(self.directory, x) for x in stale]
+        results = map_ordered(_index_captures, paths, self.workers,
+                              self.executor)
+        frames = [self.captures[self.captures['Filename'].isin(current)]]
+        for path, (rows, error) in zip(paths, results):
+            if error is not None:
+                logging.warning('{} could not be indexed: {}'.format(
+                    os.path.basename(path), error))
+                continue
+            frames.append(pandas.DataFrame(rows, columns=_COLUMNS).astype(
+                {'IntegrationTime': float,
+                 'TemperatureDetectorActual': float}))
+        self.captures = _sort(pandas.concat(
+            [f for f in frames if len(f)] or [_empty()], ignore_index=True))
+        if self.persist:
+            self.save()
+        return len(stale)
+
+    def save(self):
+        """Write the index to the directory"""
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        self.captures.to_csv(tmp, index=False,
+                             date_format='%Y-%m-%dT%H:%M:%S.%fZ')
+        os.replace(tmp, self.path)
+
+    def query(self, serial=None, direction=None, type=None, start=None,
+              end=None, integration_time=None, batch=None, run=None,
+              dark=None, min_temperature=None, max_temperature=None):
+        """Select captures. Criteria that are None are not applied.
+
+        Args:
+            serial (str or list): SerialNumber(s)
+            direction (str or list): 'Upwelling' and/or 'Downwelling'
+            type (str or list): file type(s) from the filename (i.e. 'light'
+                or 'dark')
+            start: first Datetime (inclusive, UTC)
+            end: last Datetime (exclusive, UTC)
+            integration_time (float or list): IntegrationTime(s) in the units
+                of the files (usually milliseconds)
+            batch (int or list): Batch number(s)
+            run (str or list): Run name(s)
+            dark (bool): Dark flag of the metadata
+            min_temperature (float): minimum TemperatureDetectorActual
+            max_temperature (float): maximum TemperatureDetectorActual
+
+        Returns:
+            pandas.DataFrame of the matching captures
+        """
+        x = self.captures
+        mask = np.ones(len(x), dtype=bool)
+        for column, value in [('SerialNumber', serial),
+                              ('Direction', direction), ('Type', type),
+                              ('IntegrationTime', integration_time),
+                              ('Batch', batch), ('Run', run), ('Dark', dark)]:
+            if value is not None:
+                mask &= x[column].isin(np.atleast_1d(value)).values
+        if start is not None:
+            mask &= (x['Datetime'] >= _to_timestamp(start)).values
+        if end is not None:
+            mask &= (x['Datetime'] < _to_timestamp(end)).values
+        if min_temperature is not None:
+            mask &= (x['TemperatureDetectorActual'] >=
+                     min_temperature).values
+        if max_temperature is not None:
+            mask &= (x['TemperatureDetectorActual'] <=
+                     max_temperature).values
+        return x[mask]
+
+    def files(self, captures=None):
+        """Paths of the files of captures (default all), in index order"""
+        if captures is None:
+            captures = self.captures
+        return [os.path.join(self.directory, x)
+                for x in pandas.unique(captures['Filename'])]
+
+    def load(self, captures=None, *args, **kwargs):
+        """Read only the files holding captures.
+
+        Whole files are read, so a file matched by one of its spectra also
+        returns its other spectra.
+
+        Args:
+            captures (pandas.DataFrame): rows of the index (i.e. from query).
+                If None every file is read
+
+        Args and Kwargs are supplied to read_piccolo_sequence
+
+        Returns:
+            dictionary keyed by filename
+        """
+        return read_piccolo_sequence(self.files(captures), *args, **kwargs)
+
+    def _load(self):
+        try:
+            captures = pandas.read_csv(self.path,
+                                       float_precision='round_trip')
+        except (OSError, ValueError):
+            return _empty()
+        if list(captures.columns) != _COLUMNS:
+            logging.info('rebuilding index of {}'.format(self.directory))
+            return _empty()
+        captures['Datetime'] = _to_datetime(captures['Datetime'].values)
+        return captures
+
+
+# Private funcs
+def _index_captures(path):
+    # rows of each spectrum in a file. Module level so that it can be sent
+    # to a process pool
+    stat = os.stat(path)
+    names = _index_files([path]).iloc[0]
+    headers = [x for directions in read_piccolo_file(
+        path, metadata_only=True).values() for x in directions.values()
+        if x is not None]
+    rows = []
+    for header in headers:
+        meta = header.attrs
+        row = {key: meta.get(key) for key in _METADATA}
+        if row['Datetime'] is not None:
+            row['Datetime'] = _to_datetime([row['Datetime']])[0]
+        for key in ['Batch', 'SequenceNumber', 'Type']:
+            # fall back to the metadata for non standard filenames
+            row[key] = meta.get(key) if names[key] is None else names[key]
+        row.update(Filename=os.path.basename(path), Size=stat.st_size,
+                   MTime=stat.st_mtime_ns)
+        rows.append(row)
+    return rows
+
+
+def _empty():
+    captures = pandas.DataFrame({c: [] for c in _COLUMNS})
+    captures['Datetime'] = captures['Datetime'].astype('<M8[ns]')
+    return captures
+
+
+def _sort(captures):
+    return captures.sort_values(['Batch', 'SequenceNumber', 'Filename'],
+                                kind='stable').reset_index(drop=True)
+
+
+def _to_timestamp(value):
+    # naive UTC
+    return pandas.Timestamp(_to_datetime([value])[0])
@@ -1,14 +1,31 @@
 """Piccolo file (.pico) input/output
 """
+import collections.abc
+import functools
 import json
 import numpy as np
 import pandas
 import os
+import re
+import warnings
 import xarray
 import logging
 
+from . import profiling
+from ._parallel import import_dask, is_dask_array, map_ordered
+from .cache import PicoCache
+from .compact import _evaluate_wavelengths, as_dataarray, \
+    make_compact_spectrum, sequence_to_xarray
+from .stats import METRICS, RunningStatistics
+from .store import _group_sequence, _merge_directions, _split_attrs, \
+    _spectra_to_dataarray, _stack_spectra
 
-def aggregate_sequence(piccolo_sequence, agg_metric='mean'):
+# standard Piccolo filename i.e. b000000_s000001_light.pico
+_FILENAME_PATTERN = re.compile(r'^b(\d+)_s(\d+)_(\w+)\.pico$')
+
+
+def aggregate_sequence(piccolo_sequence, agg_metric='mean', streaming=False,
+                       median_buffer=101):
     """Performs an aggregation over repeat measurements
 
     Args:
@@ -16,10 +33,23 @@ def aggregate_sequence(piccolo_sequence, agg_metric='mean'):
             generated by piccololite.read_piccolo_sequence
         agg_metric (str) : aggregation metric. Currently
             mean, median, min, max, std and var are supported.
+        streaming (bool) : if True, spectra are folded in one at a time
+            using online statistics so that memory does not grow with the
+            number of repeats. Combine with a lazy PiccoloSequence to avoid
+            holding the sequence in memory.
+        median_buffer (int) : spectra held per level of the streaming
+            median. The median is exact up to this many repeats and a
+            remedian approximation beyond. Must be at least 2
 
     Returns:
         aggregated sequence
     """
+    if median_buffer < 2:
+        raise ValueError('median_buffer must be at least 2')
+    if streaming:
+        return _aggregate_streaming(piccolo_sequence, agg_metric,
+                                    median_buffer)
+
     def _apply_agg(x):
         if agg_metric == 'mean':
             return x.mean(dim='repeat')
@@ -54,79 +84,238 @@ def aggregate_sequence(piccolo_sequence, agg_metric='mean'):
     return out
 
 
-def read_piccolo_file(piccolo_data, assign_coords=False):
+def read_piccolo_file(piccolo_data, assign_coords=False, cache=None,
+                      dask=False, compact=False, metadata_only=False):
     """Read in a piccolo data file.
 
     Args:
         piccolo_data: Can be 1. a valid filepath 2. json-like string
             containing piccolo data
         assign_coords: a list of coords to assign to new dimensions
+        cache: a PicoCache or cache directory. If given, filepaths are
+            read from the cache when it is up to date
+        dask (bool): if True, only the metadata of a filepath is read and
+            the pixels are dask arrays which are read when computed.
+            Requires dask
+        compact (bool): if True, spectra are CompactSpectrum records of raw
+            counts referencing shared instrument metadata rather than
+            DataArrays. Convert with piccololite.sequence_to_xarray
+        metadata_only (bool): if True, spectra are SpectrumHeader records of
+            the metadata and number of pixels. Pixels are not decoded and no
+            wavelengths are computed
     """
+    if compact and (dask or assign_coords):
+        raise ValueError('compact cannot be combined with dask or '
+                         'assign_coords')
+    if metadata_only and (dask or assign_coords or compact):
+        raise ValueError('metadata_only cannot be combined with dask, '
+                         'assign_coords or compact')
+    if profiling.enabled():
+        start = profiling.clock()
     try:
         # assume a filepath first
-        _data = _read_from_json_file(piccolo_data)
+        if dask:
+            _data = _read_lazy_pico_file(piccolo_data, cache)
+        elif metadata_only:
+            _data = _read_pico_header(piccolo_data)
+        else:
+            _data = _read_from_pico_file(piccolo_data, cache)
         fpath = os.path.abspath(piccolo_data)
 
     except (FileNotFoundError, TypeError, OSError) as f:
         fpath = 'NA'
         try:
             # try and read string directly
-            _data = _parse_from_string(piccolo_data)
+            if metadata_only:
+                _data = _parse_header_from_string(piccolo_data)
+            else:
+                _data = _parse_from_string(piccolo_data)
         except TypeError:
             if type(piccolo_data) == dict:
                 _data = piccolo_data
             else:
                 raise f
 
-    spectra = []
-    names = []
-    for i, ds in enumerate(_data['Spectra']):
-        _pixel = _make_spectrum(ds)
-        logging.debug(('spectrum raw length: {}'.format(len(_pixel))))
-        _pixel.attrs['SourceFilePath'] = fpath
-        _pixel.attrs['Direction'] = _pixel.attrs['Direction'].capitalize()
-        _pixel.attrs['SerialNumber'] = _pixel.attrs['SerialNumber'].upper()
-        # assign wavelength coordinate
-        _pixel = _pixel.assign_coords({'wavelength': ('pixel',
-                                                      _get_wavelengths(_pixel))
-                                       })
-        if assign_coords:
-            _pixel = _assign_coords(_pixel, assign_coords)
-
-        spectra.append(_pixel.swap_dims({'pixel': 'wavelength'}))
-        names.append(_pixel.attrs['SerialNumber'])
-
-    # sort into 1 dataset per instrument
-    out = {k:{'Downwelling':None, 'Upwelling':None} for k in np.unique(names)}
-
-    for s in spectra:
-        name = s.attrs['SerialNumber'].upper()
-        direction = s.attrs['Direction'].capitalize()
-        out[name][direction] = s
+    if metadata_only:
+        out = _make_header_file(_data, fpath)
+    elif compact:
+        out = _make_compact_file(_data, fpath)
+    else:
+        out = _make_xarray_file(_data, fpath, assign_coords)
+    if profiling.enabled():
+        profiling.record('read', start, file=os.path.basename(fpath),
+                         spectra=len(_data['Spectra']))
     return out
 
-def read_piccolo_sequence(files, *args, **kwargs):
+def read_piccolo_sequence(files, *args, workers=None, executor=None,
+                          errors='raise', lazy=False, cache_size=128,
+                          **kwargs):
     """Read a directory of .pico files or an explicit list.
 
     Args and Kwargs can be supplied to read_piccolo_file
 
     Args:
         files: Can be a list or path to a directory of .pico files
-    """
-    if type(files) == str:
-        root = files
-        # assume a directory
-        flist = os.listdir(root)
-        files = [os.path.join(root, x) for x in flist if x.endswith('.pico')]
+        workers (int): number of files to parse concurrently. By default
+            files are read one after another
+        executor: 'thread' (suited to slow or network storage), 'process'
+            (suited to parse-bound reads) or a concurrent.futures.Executor
+        errors (str): 'raise' to raise a SequenceReadError once every file
+            has been attempted, or 'skip' to log and omit files that could
+            not be read
+        lazy (bool): if True, return a PiccoloSequence which only parses
+            files when they are accessed. Cannot be combined with workers,
+            executor or errors='skip'
+        cache_size (int): maximum number of parsed files held in memory by a
+            lazy sequence
 
+    Returns:
+        dictionary keyed by filename, in sorted order when a directory is
+        given and in the given order for a list
+    """
+    if errors not in ('raise', 'skip'):
+        raise ValueError('{} not a recognised errors option'.format(errors))
+
+    if lazy:
+        if workers is not None or executor is not None or errors != 'raise':
+            raise ValueError('workers, executor and errors cannot be '
+                             'combined with lazy')
+        return PiccoloSequence(files, *args, cache_size=cache_size, **kwargs)
+
+    kwargs = _open_cache(kwargs)
+    files = _list_pico_files(files)
+    task = functools.partial(_read_file_task, args=args, kwargs=kwargs)
+    results = map_ordered(task, files, workers, executor)
     out = {}
-    for path in files:
+    failed = {}
+    for path, (result, error) in zip(files, results):
         fname = os.path.basename(path)
-        out[fname] = read_piccolo_file(path, *args, **kwargs)
+        if error is not None:
+            logging.warning('{} could not be read: {}'.format(fname, error))
+            failed[fname] = error
+        else:
+            out[fname] = result
 
+    if failed and errors == 'raise':
+        raise SequenceReadError(failed, out)
     return out
 
-def sequence_to_datasets(piccolo_sequence, clean_metadata=True):
+
+class SequenceReadError(ValueError):
+    """Raised when one or more files in a sequence could not be read.
+
+    Attributes:
+        errors (dict): exception raised for each failed file, keyed by
+            filename
+        sequence (dict): the files that were read successfully
+    """
+
+    def __init__(self, errors, sequence):
+        self.errors = errors
+        self.sequence = sequence
+        super().__init__('{} file(s) could not be read: {}'.format(
+            len(errors), ', '.join(errors)))
+
+
+class SpectrumHeader:
+    """The metadata of a spectrum, read without its pixels.
+
+    Returned by read_piccolo_file and read_piccolo_sequence with
+    metadata_only=True.
+
+    Attributes:
+        attrs (dict): metadata, as the attrs of the DataArray that
+            read_piccolo_file returns (with SourceFilePath)
+        pixel_count (int): number of pixels
+    """
+    __slots__ = ('attrs', 'pixel_count')
+
+    def __init__(self, attrs, pixel_count):
+        self.attrs = attrs
+        self.pixel_count = pixel_count
+
+    def __len__(self):
+        return self.pixel_count
+
+    def __repr__(self):
+        return '<SpectrumHeader {} {} ({} pixels)>'.format(
+            self.attrs.get('SerialNumber'), self.attrs.get('Direction'),
+            self.pixel_count)
+
+    @property
+    def shape(self):
+        return (self.pixel_count,)
+
+    def load(self, *args, **kwargs):
+        """Read the full spectrum from its source file.
+
+        Args and Kwargs are supplied to read_piccolo_file
+
+        Returns:
+            DataArray
+        """
+        fpath = self.attrs['SourceFilePath']
+        if fpath == 'NA':
+            raise ValueError('spectrum was not read from a file')
+        return read_piccolo_file(fpath, *args, **kwargs)[
+            self.attrs['SerialNumber']][self.attrs['Direction']]
+
+
+class PiccoloSequence(collections.abc.Mapping):
+    """Lazily read sequence of .pico files.
+
+    Behaves like the dictionary returned by read_piccolo_sequence, but the
+    directory is only indexed on creation. Files are parsed when accessed
+    and the most recently used files are kept in a bounded cache.
+
+    Attributes:
+        index (pandas.DataFrame): Path, Batch, SequenceNumber and Type of
+            each file (parsed from the filename), indexed by filename
+    """
+
+    def __init__(self, files, *args, cache_size=128, **kwargs):
+        """
+        Args:
+            files: Can be a list or path to a directory of .pico files
+            cache_size (int): maximum number of parsed files held in memory
+
+        Args and Kwargs are supplied to read_piccolo_file
+        """
+        self.cache_size = cache_size
+        self._args = args
+        self._kwargs = _open_cache(kwargs)
+        self._cache = collections.OrderedDict()
+        self.index = _index_files(_list_pico_files(files))
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if key not in self:
+            raise KeyError(key)
+        out = read_piccolo_file(self.index.loc[key, 'Path'], *self._args,
+                                **self._kwargs)
+        self._cache[key] = out
+        while len(self._cache) > max(self.cache_size, 0):
+            self._cache.popitem(last=False)
+        return out
+
+    def __contains__(self, key):
+        return key in self.index.index
+
+    def __iter__(self):
+        return iter(self.index.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return '<PiccoloSequence: {} files ({} cached)>'.format(
+            len(self), len(self._cache))
+
+
+def sequence_to_datasets(piccolo_sequence, clean_metadata=True,
+                         layout='variables'):
     """Converts a Piccolo sequence dictionary to xarray Datasets.
 
     Each dataset represents a single instrument.
@@ -135,11 +324,24 @@ def sequence_to_datasets(piccolo_sequence, clean_metadata=True):
         piccolo_sequence: nested dictionary of piccolo spectra.
         clean_metadata (bool): if True, attempts to clean metadata
             so that the dataset is safe for writing to netcdf
+        layout (str): 'variables' creates one variable per file and
+            direction (i.e. b000000_s000001_light_QEP00984_Upwelling).
+            'capture' creates one (capture, wavelength) variable per
+            direction, with metadata that varies between files as capture
+            coordinates prefixed with the direction (i.e.
+            Upwelling_Datetime) and constant metadata as attributes
 
     Returns:
         dictionary of xarray Datasets keyed by instrument serial
     """
-    serials = list(piccolo_sequence.values())[0].keys()
+    piccolo_sequence = sequence_to_xarray(piccolo_sequence)
+    if layout == 'capture':
+        return _sequence_to_capture_datasets(piccolo_sequence,
+                                             clean_metadata)
+    if layout != 'variables':
+        raise ValueError('{} not a recognised layout'.format(layout))
+
+    serials = next(iter(piccolo_sequence.values())).keys()
     logging.debug(serials)
     out = {k:{} for k in serials}
     # iterate serial numbers
@@ -159,16 +361,24 @@ def sequence_to_datasets(piccolo_sequence, clean_metadata=True):
 
     return {k: xarray.merge([v]) for k,v in out.items()}
 
-def sequence_to_netcdf(piccolo_sequence, fname):
+def sequence_to_netcdf(piccolo_sequence, fname, layout='variables',
+                       compute=True):
     """Converts a Piccolo sequence dictionary to NetCDF files.
 
-    Each file represents a single instrument.
+    Each file represents a single instrument. Dask backed sequences are
+    computed chunk by chunk as they are written.
 
     Args:
         piccolo_sequence: nested dictionary of piccolo spectra.
             Must be in the form [filename][instrument][downwelling]
             or a dictionary of xarray Datasets
         fname (str): destination filename
+        layout (str): dataset layout passed to sequence_to_datasets
+        compute (bool): if False, return dask delayed writes rather than
+            writing immediately
+
+    Returns:
+        list of dask delayed objects if compute is False
     """
 
     def parse_fname(ser):
@@ -176,15 +386,138 @@ def sequence_to_netcdf(piccolo_sequence, fname):
             return fname + '_{}.nc'.format(ser)
         else:
             return fname[:-3] + '_{}.nc'.format(ser)
-    try:
-        for serial, ds in piccolo_sequence.items():
-            ds.to_netcdf(parse_fname(serial))
-    except AttributeError:
-        piccolo_sequence = sequence_to_datasets(piccolo_sequence, True)
-        for serial, ds in piccolo_sequence.items():
-            ds.to_netcdf(parse_fname(serial))
+    if not all(hasattr(ds, 'to_netcdf') for ds in piccolo_sequence.values()):
+        piccolo_sequence = sequence_to_datasets(piccolo_sequence, True,
+                                                layout)
+    delayed = []
+    for serial, ds in piccolo_sequence.items():
+        delayed.append(ds.to_netcdf(parse_fname(serial), compute=compute))
+    if not compute:
+        return delayed
+
+
+def sequence_to_zarr(piccolo_sequence, store, capture_chunk=1, compute=True):
+    """Writes a Piccolo sequence to a Zarr store, one group per instrument.
+
+    Groups use the capture layout of sequence_to_datasets and spectra are
+    chunked along capture, so a single capture can be read without
+    decompressing the rest of the sequence.
+
+    To write in parallel, read the sequence with dask=True and write it with
+    compute=False. This writes the coordinates and metadata of every capture
+    but no spectra. Workers can then write disjoint capture ranges with
+    sequence_to_zarr_region.
+
+    Args:
+        piccolo_sequence: nested dictionary of piccolo spectra
+            or a dictionary of capture layout xarray Datasets
+        store: path or Zarr store
+        capture_chunk (int): number of captures per chunk
+        compute (bool): if False, return dask delayed writes of the spectra
+
+    Returns:
+        list of dask delayed objects if compute is False
+    """
+    if not all(hasattr(ds, 'to_zarr') for ds in piccolo_sequence.values()):
+        piccolo_sequence = sequence_to_datasets(piccolo_sequence, False,
+                                                'capture')
+    delayed = []
+    for serial, ds in piccolo_sequence.items():
+        encoding = {}
+        ds = ds.copy()
+        for k in ds.data_vars:
+            encoding[k] = {'chunks': (capture_chunk,) + ds[k].shape[1:]}
+            if is_dask_array(ds[k].data):
+                ds[k] = ds[k].chunk({'capture': capture_chunk})
+        delayed.append(ds.to_zarr(store, group=serial, mode='w',
+                                  encoding=encoding, compute=compute))
+    if not compute:
+        return delayed
+
+
+def sequence_to_zarr_region(piccolo_sequence, store):
+    """Writes spectra into captures already present in a Zarr store.
+
+    Captures are located by filename in a store initialised by
+    sequence_to_zarr. Calls writing disjoint capture ranges, aligned to the
+    capture chunks, can run at the same time in separate processes.
+
+    Args:
+        piccolo_sequence: nested dictionary of piccolo spectra
+            or a dictionary of capture layout xarray Datasets. The captures
+            of each instrument must be contiguous in the store
+        store: path or Zarr store
+    """
+    if not all(hasattr(ds, 'to_zarr') for ds in piccolo_sequence.values()):
+        piccolo_sequence = sequence_to_datasets(piccolo_sequence, False,
+                                                'capture')
+    for serial, ds in piccolo_sequence.items():
+        target = xarray.open_zarr(store, group=serial)
+        region = _get_zarr_region(target, ds)
+        # only spectra are written, coordinates are written at creation
+        ds = ds[list(ds.data_vars)].drop_vars(list(ds.coords))
+        ds.to_zarr(store, group=serial, region={'capture': region})
+
 
 # Private funcs
+def _get_zarr_region(target, ds):
+    # contiguous, chunk aligned slice of target covering the captures of ds
+    index = target.indexes['capture']
+    positions = index.get_indexer(ds['capture'].values)
+    if (positions < 0).any():
+        raise ValueError('Captures not found in Zarr store')
+    start = positions.min()
+    stop = start + len(positions)
+    if not np.array_equal(positions, np.arange(start, stop)):
+        raise ValueError('Captures must be contiguous in the Zarr store')
+    for k in ds.data_vars:
+        chunk = target[k].encoding['chunks'][0]
+        if start % chunk or (stop % chunk and stop != len(index)):
+            raise ValueError('Captures {}:{} not aligned to chunks of {} '
+                             'captures'.format(start, stop, chunk))
+    return slice(int(start), int(stop))
+
+
+def _list_pico_files(files):
+    if type(files) == str:
+        root = files
+        # assume a directory
+        flist = sorted(os.listdir(root))
+        files = [os.path.join(root, x) for x in flist if x.endswith('.pico')]
+    return list(files)
+
+
+def _index_files(files):
+    # Batch, SequenceNumber and Type from bNNNNNN_sNNNNNN_type.pico
+    rows = []
+    for path in files:
+        fname = os.path.basename(path)
+        match = _FILENAME_PATTERN.match(fname)
+        if match:
+            batch, seq, _type = match.groups()
+            rows.append((fname, path, int(batch), int(seq), _type))
+        else:
+            rows.append((fname, path, None, None, None))
+    index = pandas.DataFrame(
+        rows, columns=['Filename', 'Path', 'Batch', 'SequenceNumber', 'Type']
+    ).set_index('Filename')
+    # as with a dictionary, the last file of a given name wins
+    return index[~index.index.duplicated(keep='last')]
+
+
+def _open_cache(kwargs):
+    # a cache directory is opened once rather than once per file
+    cache = kwargs.get('cache')
+    if cache is None or isinstance(cache, PicoCache):
+        return kwargs
+    return dict(kwargs, cache=PicoCache(cache))
+
+
+def _read_file_task(path, args=(), kwargs=None):
+    # module level so that it can be sent to a process pool
+    return read_piccolo_file(path, *args, **(kwargs or {}))
+
+
 def _assign_coords(dataArray, coords = ['Dark', 'SerialNumber', 'Direction']):
     for c in coords:
         try:
@@ -194,6 +527,45 @@ def _assign_coords(dataArray, coords = ['Dark', 'SerialNumber', 'Direction']):
     return dataArray
 
 
+def _read_from_pico_file(fpath, cache=None):
+    if cache is None:
+        return _read_from_json_file(fpath)
+    if not isinstance(cache, PicoCache):
+        cache = PicoCache(cache)
+    _data = cache.get(fpath)
+    if _data is None:
+        _data = _read_from_json_file(fpath)
+        for reading in _data['Spectra']:
+            reading['Wavelengths'] = _evaluate_wavelengths(
+                reading['Metadata']['WavelengthCalibrationCoefficients'],
+                len(reading['Pixels']))
+        cache.put(fpath, _data)
+    return _data
+
+
+def _read_lazy_pico_file(fpath, cache=None):
+    # metadata now, pixels as dask arrays loaded by one task per file
+    dask = import_dask()
+    _data = _read_pico_header(fpath)
+    loaded = dask.delayed(_load_pixel_arrays, pure=True)(
+        os.path.abspath(fpath), cache)
+    for i, reading in enumerate(_data['Spectra']):
+        reading['Pixels'] = dask.array.from_delayed(
+            loaded[i], shape=(reading.pop('PixelCount'),), dtype=float)
+    return _data
+
+
+def _load_pixel_arrays(fpath, cache=None):
+    return [np.asarray(x['Pixels'], dtype=float)
+            for x in _read_from_pico_file(fpath, cache)['Spectra']]
+
+
+def _read_pico_header(fpath):
+    # read metadata and the number of pixels without decoding pixels
+    with open(fpath, 'r') as f:
+        return _parse_header_from_string(f.read())
+
+
 def _read_from_json_file(fpath):
     # read only open
     with open(fpath, 'r') as f:
@@ -201,12 +573,150 @@ def _read_from_json_file(fpath):
 
 
 def _parse_from_string(data_string):
+    if isinstance(data_string, str):
+        try:
+            return _parse_pico_string(data_string)
+        except (ValueError, KeyError, TypeError, IndexError):
+            # fallback to the generic json parser
+            logging.debug('fast .pico parse failed, falling back to json')
     return json.loads(data_string)
 
 
+def _parse_header_from_string(data_string):
+    if isinstance(data_string, str):
+        try:
+            return _parse_pico_string(data_string, decode_pixels=False)
+        except (ValueError, KeyError, TypeError, IndexError):
+            logging.debug('fast .pico parse failed, falling back to json')
+    _data = json.loads(data_string)
+    for reading in _data['Spectra']:
+        reading['PixelCount'] = len(reading.pop('Pixels'))
+    return _data
+
+
+def _parse_pico_string(data_string, decode_pixels=True):
+    # Fast parser for the known .pico schema. The Pixels lists are cut out
+    # and decoded directly into numpy arrays so that json only has to parse
+    # the (small) metadata blocks. If decode_pixels is False only the number
+    # of pixels is returned (as PixelCount)
+    pieces = []
+    pixels = []
+    pos = 0
+    while True:
+        key = data_string.find('"Pixels"', pos)
+        if key < 0:
+            break
+        opening = data_string.find('[', key)
+        closing = data_string.find(']', opening)
+        if opening < 0 or closing < 0:
+            raise ValueError('Malformed Pixels list')
+        pieces.append(data_string[pos:key])
+        pieces.append('"Pixels": {}'.format(len(pixels)))
+        text = data_string[opening + 1:closing]
+        if decode_pixels:
+            pixels.append(_decode_pixels(text))
+        else:
+            pixels.append(text.count(',') + 1 if text.strip() else 0)
+        pos = closing + 1
+    pieces.append(data_string[pos:])
+
+    data = json.loads(''.join(pieces))
+    if pixels:
+        for reading in data['Spectra']:
+            if decode_pixels:
+                reading['Pixels'] = pixels[reading['Pixels']]
+            else:
+                reading['PixelCount'] = pixels[reading.pop('Pixels')]
+    elif not decode_pixels:
+        raise ValueError('No Pixels found')
+    return data
+
+
+def _decode_pixels(text):
+    if not text.strip():
+        return np.empty(0, dtype=float)
+    # raw counts are integers, which are much faster to decode than floats
+    for dtype in (np.int64, float):
+        with warnings.catch_warnings():
+            # unparseable values are reported as a DeprecationWarning
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                pix = np.fromstring(text, dtype=dtype, sep=',')
+            except (DeprecationWarning, ValueError):
+                continue
+        if len(pix) == text.count(',') + 1:
+            return pix.astype(float)
+    raise ValueError('Pixels could not be decoded')
+
+
+def _make_xarray_file(_data, fpath, assign_coords=False):
+    spectra = []
+    names = []
+    for i, ds in enumerate(_data['Spectra']):
+        _pixel = _make_spectrum(ds)
+        logging.debug(('spectrum raw length: {}'.format(len(_pixel))))
+        _pixel.attrs['SourceFilePath'] = fpath
+        _pixel.attrs['Direction'] = _pixel.attrs['Direction'].capitalize()
+        _pixel.attrs['SerialNumber'] = _pixel.attrs['SerialNumber'].upper()
+        # assign wavelength coordinate
+        if 'Wavelengths' in ds:
+            wavelengths = ds['Wavelengths']
+        else:
+            wavelengths = _get_wavelengths(_pixel)
+        _pixel = _pixel.assign_coords({'wavelength': ('pixel', wavelengths)})
+        if assign_coords:
+            _pixel = _assign_coords(_pixel, assign_coords)
+
+        spectra.append(_pixel.swap_dims({'pixel': 'wavelength'}))
+        names.append(_pixel.attrs['SerialNumber'])
+
+    # sort into 1 dataset per instrument
+    out = {k:{'Downwelling':None, 'Upwelling':None} for k in np.unique(names)}
+
+    for s in spectra:
+        name = s.attrs['SerialNumber'].upper()
+        direction = s.attrs['Direction'].capitalize()
+        out[name][direction] = s
+    return out
+
+
+def _make_compact_file(_data, fpath):
+    out = {}
+    for reading in _data['Spectra']:
+        meta = dict(reading['Metadata'])
+        meta['SourceFilePath'] = fpath
+        meta['Direction'] = meta['Direction'].capitalize()
+        meta['SerialNumber'] = meta['SerialNumber'].upper()
+        spectrum = make_compact_spectrum(meta, reading['Pixels'],
+                                         reading.get('Wavelengths'))
+        out.setdefault(meta['SerialNumber'], {
+            'Downwelling': None, 'Upwelling': None})[meta['Direction']] = \
+            spectrum
+    return dict(sorted(out.items()))
+
+
+def _make_header_file(_data, fpath):
+    out = {}
+    for reading in _data['Spectra']:
+        meta = dict(reading['Metadata'])
+        meta['SourceFilePath'] = fpath
+        meta['Direction'] = meta['Direction'].capitalize()
+        meta['SerialNumber'] = meta['SerialNumber'].upper()
+        if 'PixelCount' in reading:
+            n = reading['PixelCount']
+        else:
+            n = len(reading['Pixels'])
+        out.setdefault(meta['SerialNumber'], {
+            'Downwelling': None, 'Upwelling': None})[meta['Direction']] = \
+            SpectrumHeader(meta, n)
+    return dict(sorted(out.items()))
+
+
 def _make_spectrum(reading):
     # do baseline parsing to xarray
-    pix = np.array(reading['Pixels'], dtype=float)
+    pix = reading['Pixels']
+    if not is_dask_array(pix):
+        pix = np.asarray(pix, dtype=float)
     da = xarray.DataArray(pix,
                           coords = [('pixel', np.arange(len(pix)))],
                           attrs = reading['Metadata'])
@@ -219,14 +729,74 @@ def _get_wavelengths(dataArray):
     wpoly = np.poly1d(coefs[::-1])
     return wpoly(dataArray.pixel)
 
+
+def _sequence_to_capture_datasets(piccolo_sequence, clean_metadata=True):
+    out = {}
+    for (serial, direction), (labels, spectra) in _group_sequence(
+            piccolo_sequence).items():
+        data, wavelength, pixel = _stack_spectra(spectra, join='outer')
+        constant, columns = _split_attrs([x.attrs for x in spectra])
+        if clean_metadata:
+            constant = _clean_attrs(constant)
+        arr = _spectra_to_dataarray(data, wavelength, pixel, labels, columns,
+                                    constant, direction)
+        out.setdefault(serial, {})[direction] = arr
+        logging.debug('dataset converted: {}_{}'.format(serial, direction))
+    return {k: _merge_directions(v) for k, v in out.items()}
+
+
+def _aggregate_streaming(piccolo_sequence, agg_metric, median_buffer):
+    if agg_metric not in METRICS:
+        raise ValueError('{} not a supported metric'.format(agg_metric))
+    stats = {}
+    attrs = {}
+    keys = {}
+    for fname, f in piccolo_sequence.items():
+        if 'light' not in fname:
+            continue
+        for serial, directions in f.items():
+            for direc in ['Upwelling', 'Downwelling']:
+                arr = directions.get(direc)
+                if arr is None:
+                    continue
+                # one spectrum at a time, so lazy sequences are not loaded
+                # all at once
+                arr = as_dataarray(arr)
+                if (serial, direc) not in stats:
+                    stats[(serial, direc)] = RunningStatistics(
+                        agg_metric == 'median', median_buffer)
+                    attrs[(serial, direc)] = _clean_metadata(arr)
+                    keys[(serial, direc)] = []
+                stats[(serial, direc)].update(arr.values,
+                                              arr['wavelength'].values)
+                keys[(serial, direc)].append('{}_{}_{}'.format(
+                    fname.split('.pico')[0], serial, direc))
+
+    if not stats:
+        raise ValueError('piccolo_sequence contains no light files')
+    out = {}
+    for (serial, direc), stat in stats.items():
+        combi = xarray.DataArray(stat.result(agg_metric),
+                                 coords=[('wavelength', stat.wavelength)],
+                                 attrs=attrs[(serial, direc)])
+        combi.attrs['AggregationMetric'] = agg_metric
+        combi.attrs['IncludedFiles'] = keys[(serial, direc)]
+        out.setdefault(serial, {})[direc] = combi
+    return {k: xarray.Dataset(v) for k, v in out.items()}
+
+
 def _clean_metadata(da):
+    return _clean_attrs(da.attrs)
+
+
+def _clean_attrs(attrs):
     new_meta = {}
     mapping = {
         None: 'None',
         True: 'True',
         False: 'False'
     }
-    for k, v in da.attrs.items():
+    for k, v in attrs.items():
         try:
             new_meta[k] = mapping[v]
         except (KeyError, TypeError):
@@ -0,0 +1,315 @@
+"""Appendable NetCDF output of Piccolo sequences
+"""
+import logging
+import os
+import netCDF4
+import numpy as np
+
+from .io import sequence_to_datasets
+from .store import _to_column
+
+_TIME_UNITS = 'nanoseconds since 1970-01-01'
+# int64 of NaT, the fill value of time columns
+_NAT = np.iinfo(np.int64).min
+
+
+class NetCDFWriter:
+    """Writes sequences to appendable, chunked and compressed NetCDF4 files.
+
+    Each instrument is written to its own file (<fname>_<serial>.nc) in the
+    layout of sequence_to_datasets(layout='capture'): a (capture,
+    wavelength) variable per direction, per-capture metadata as capture
+    coordinates and constant metadata as attributes. The capture dimension
+    is unlimited, so appending writes the new captures in place without
+    rewriting existing data. Constant metadata that differs from the file
+    is promoted to a column, and numeric columns are stored as float64 so
+    that later values are never narrowed.
+    """
+
+    def __init__(self, fname, capture_chunk=64, zlib=True, complevel=4,
+                 shuffle=True):
+        """
+        Args:
+            fname (str): destination filename. The serial is appended
+            capture_chunk (int): number of captures per chunk
+            zlib (bool): compress variables
+            complevel (int): zlib compression level (1-9)
+            shuffle (bool): apply the HDF5 shuffle filter before compression
+        """
+        self.fname = fname
+        self.capture_chunk = capture_chunk
+        self.zlib = zlib
+        self.complevel = complevel
+        self.shuffle = shuffle
+
+    def get_path(self, serial):
+        """Returns the file path for an instrument serial"""
+        if not self.fname.endswith('.nc'):
+            return self.fname + '_{}.nc'.format(serial)
+        return self.fname[:-3] + '_{}.nc'.format(serial)
+
+    def append(self, piccolo_sequence):
+        """Append a sequence, creating files as needed.
+
+        Args:
+            piccolo_sequence: nested dictionary of piccolo spectra or a
+                dictionary of capture layout xarray Datasets
+        """
+        if not all(hasattr(ds, 'data_vars')
+                   for ds in piccolo_sequence.values()):
+            # attributes are made NetCDF compatible by _netcdf_attrs
+            piccolo_sequence = sequence_to_datasets(piccolo_sequence, False,
+                                                    'capture')
+        # every file is checked before anything is written, so a failed
+        # append leaves the files unchanged
+        opened = []
+        try:
+            for serial, ds in piccolo_sequence.items():
+                path = self.get_path(serial)
+                new = not os.path.exists(path)
+                nc = netCDF4.Dataset(path, 'w' if new else 'a')
+                opened.append((nc, ds, path, new))
+                if new:
+                    self._create(nc, ds)
+            plans = [self._plan(nc, ds) for nc, ds, _, _ in opened]
+        except Exception:
+            for nc, _, path, new in opened:
+                nc.close()
+                if new:
+                    os.remove(path)
+            raise
+        try:
+            for (nc, ds, _, _), plan in zip(opened, plans):
+                self._append(nc, ds, plan)
+        finally:
+            for nc, _, _, _ in opened:
+                nc.close()
+
+    def _create(self, nc, ds):
+        nc.createDimension('capture', None)
+        nc.createDimension('wavelength', len(ds['wavelength']))
+        nc.createVariable('capture', str, ('capture',))
+        for k in ['wavelength', 'pixel']:
+            var = nc.createVariable(k, ds[k].dtype, ('wavelength',))
+            var[:] = ds[k].values
+        nc.setncattr('coordinates', 'pixel')
+
+    def _plan(self, nc, ds):
+        # the columns of each direction, cast to their storage types
+        if len(ds['wavelength']) != len(nc.dimensions['wavelength']) or \
+                not np.allclose(nc['wavelength'][:], ds['wavelength'].values):
+            raise ValueError('Wavelength grid differs from {}'.format(
+                nc.filepath()))
+        start = len(nc.dimensions['capture'])
+        return {direction: self._plan_metadata(nc, ds, direction, start)
+                for direction in ds.data_vars}
+
+    def _plan_metadata(self, nc, ds, direction, start):
+        # returns (name, kind, old, values) for each column to write. kind
+        # is None for existing columns, and old holds the previously
+        # constant value of the rows before start for promoted columns
+        var = nc.variables.get(direction)
+        prefix = '{}_'.format(direction)
+        n = len(ds['capture'])
+        columns = {k[len(prefix):]: ds[k].values for k in ds.coords
+                   if k.startswith(prefix)}
+        # constants of the new captures are written as columns if the file
+        # already has the column or holds a different (or no) value. The
+        # attributes of a new variable are written when it is created
+        for k, v in ds[direction].attrs.items():
+            if prefix + k not in nc.variables:
+                if var is None or (k in var.ncattrs() and
+                                   _same_attr(var.getncattr(k), v)):
+                    continue
+            columns[k] = _to_column(k, [v] * n)
+
+        plan = []
+        for k, values in columns.items():
+            name = prefix + k
+            if name in nc.variables:
+                kind = _column_kind(nc[name])
+                plan.append((name, None, None, _prepare(values, kind, name)))
+                continue
+            # promote a previously constant attribute to a column
+            old = None
+            if var is not None and k in var.ncattrs():
+                previous = _decode_attr(var.getncattr(k))
+                if previous is not None:
+                    old = _to_column(k, [previous] * start)
+            kind = _new_column_kind(
+                values if old is None else [old, values])
+            if kind == 'bool' and start and old is None:
+                # earlier rows have no value, which a bool cannot hold
+                kind = 'f8'
+            if old is not None:
+                old = _prepare(old, kind, name)
+            plan.append((name, kind, old, _prepare(values, kind, name)))
+
+        # columns missing from the new captures
+        for name in nc.variables:
+            if not name.startswith(prefix) or name[len(prefix):] in columns:
+                continue
+            kind = _column_kind(nc[name])
+            if kind == 'str':
+                plan.append((name, None, None, _prepare([''] * n, kind,
+                                                        name)))
+            elif kind == 'bool':
+                raise ValueError('{} has no value for the new captures'
+                                 .format(name))
+            # numbers and times are left as NaN and NaT fill values
+        return plan
+
+    def _append(self, nc, ds, plan):
+        start = len(nc.dimensions['capture'])
+        stop = start + len(ds['capture'])
+        rows = slice(start, stop)
+        nc['capture'][start:stop] = ds['capture'].values.astype(object)
+
+        for direction in ds.data_vars:
+            arr = ds[direction]
+            if direction not in nc.variables:
+                var = self._create_variable(nc, direction, arr.dtype,
+                                            ('capture', 'wavelength'))
+                var.setncatts(_netcdf_attrs(arr.attrs))
+            var = nc[direction]
+            var[rows, :] = arr.values
+            prefix = '{}_'.format(direction)
+            for name, kind, old, values in plan[direction]:
+                if kind is not None:
+                    if name[len(prefix):] in var.ncattrs():
+                        var.delncattr(name[len(prefix):])
+                    col = self._create_column(nc, name, kind)
+                    if old is not None and start:
+                        col[0:start] = old
+                if stop > start:
+                    nc[name][rows] = values
+        logging.debug('{} captures appended to {}'.format(
+            stop - start, nc.filepath()))
+
+    def _create_column(self, nc, name, kind):
+        if kind == 'time':
+            # NaT for captures without a value
+            col = self._create_variable(nc, name, 'i8', ('capture',),
+                                        fill=_NAT)
+            col.units = _TIME_UNITS
+            col.calendar = 'proleptic_gregorian'
+        elif kind == 'bool':
+            col = self._create_variable(nc, name, 'i1', ('capture',))
+            # decoded back to bool by xarray
+            col.setncattr('dtype', 'bool')
+        elif kind == 'str':
+            col = nc.createVariable(name, str, ('capture',))
+        else:
+            # numbers are stored as f8 so that later appends (i.e. a
+            # fractional IntegrationTime after integers) are never narrowed
+            col = self._create_variable(nc, name, 'f8', ('capture',))
+        return col
+
+    def _create_variable(self, nc, name, dtype, dims, fill=None):
+        chunks = (self.capture_chunk,) + tuple(
+            len(nc.dimensions[d]) for d in dims[1:])
+        if fill is None and np.dtype(dtype).kind == 'f':
+            fill = np.nan
+        return nc.createVariable(name, dtype, dims, zlib=self.zlib,
+                                 complevel=self.complevel,
+                                 shuffle=self.shuffle, chunksizes=chunks,
+                                 fill_value=fill)
+
+
+def sequence_to_appendable_netcdf(piccolo_sequence, fname, **kwargs):
+    """Appends a Piccolo sequence to chunked, compressed NetCDF files.
+
+    Files are created on the first call and captures are appended in place
+    on later calls. Kwargs are supplied to NetCDFWriter.
+
+    Args:
+        piccolo_sequence: nested dictionary of piccolo spectra.
+        fname (str): destination filename
+
+    Returns:
+        NetCDFWriter
+    """
+    writer = NetCDFWriter(fname, **kwargs)
+    writer.append(piccolo_sequence)
+    return writer
+
+
+# Private funcs
+def _column_kind(var):
+    # storage kind of a column in the file
+    if var.dtype == str:
+        return 'str'
+    attrs = var.ncattrs()
+    if 'units' in attrs and var.units == _TIME_UNITS:
+        return 'time'
+    if 'dtype' in attrs and var.getncattr('dtype') == 'bool':
+        return 'bool'
+    return var.dtype.str
+
+
+def _new_column_kind(arrays):
+    # storage kind able to hold every array (or list of arrays) of a column
+    if not isinstance(arrays, list):
+        arrays = [arrays]
+    kinds = set(np.asarray(x).dtype.kind for x in arrays)
+    if kinds & set('USO'):
+        return 'str'
+    if kinds == {'M'}:
+        return 'time'
+    if kinds == {'b'}:
+        return 'bool'
+    return 'f8'
+
+
+def _prepare(values, kind, name):
+    # cast column values to their storage type, raising rather than
+    # truncating values the column cannot hold
+    values = np.asarray(values)
+    if kind == 'str':
+        return np.array(['' if v is None else str(v) for v in values],
+                        dtype=object)
+    if kind == 'time':
+        return values.astype('<M8[ns]').astype('i8')
+    if kind == 'bool':
+        target = np.dtype('i1')
+        ok = values.dtype.kind == 'b'
+    else:
+        target = np.dtype(kind)
+        ok = np.can_cast(values.dtype, target, 'safe')
+    if not ok:
+        raise ValueError('{} values cannot be written to {} ({}) without '
+                         'loss'.format(values.dtype, name, kind))
+    return values.astype(target)
+
+
+def _same_attr(stored, value):
+    # compare a file attribute with a new constant value
+    value = _netcdf_attrs({'value': value})['value']
+    try:
+        return bool(np.array_equal(np.asarray(stored), np.asarray(value)))
+    except (TypeError, ValueError):
+        return False
+
+
+def _decode_attr(value):
+    # inverse of _netcdf_attrs for the values it converts
+    if isinstance(value, str):
+        return {'None': None, 'True': True, 'False': False}.get(value, value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _netcdf_attrs(attrs):
+    # attributes must be numbers, strings or 1-D arrays of numbers
+    out = {}
+    for k, v in attrs.items():
+        if v is None or isinstance(v, (bool, np.bool_)):
+            v = str(v)
+        elif isinstance(v, (list, tuple)) and \
+                any(x is None or isinstance(x, str) for x in v):
+            v = str(v)
+        out[k] = v
+    return out
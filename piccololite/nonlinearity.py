@@ -0,0 +1,102 @@
+"""Non linearity correction kernels
+"""
+import functools
+
+import numpy as np
+
+# lookup tables kept by non_linearity_lut. A table has SaturationLevel + 1
+# values (about 1.6 MB for a QEP), and a new one is needed for each dark
+# signal, so only enough for the spectrometers of a dark reference are kept
+_LUT_CACHE_SIZE = 4
+
+
+def horner(coefs, x, out=None):
+    """Evaluate a polynomial with Horner's scheme without temporaries.
+
+    Args:
+        coefs: coefficients in increasing power order (as in the
+            NonlinearityCorrectionCoefficients metadata)
+        x: numpy array
+        out: array to write the result to. Allocated (with the dtype of x)
+            if None
+
+    Returns:
+        out
+    """
+    if out is None:
+        out = np.empty_like(x)
+    out.fill(coefs[-1])
+    for c in coefs[-2::-1]:
+        out *= x
+        out += c
+    return out
+
+
+def correct_non_linearity(x, coefs, dark):
+    """Correct a batch of counts in place.
+
+    Computes dark + (x - dark) / f(x - dark), where f is the non linearity
+    polynomial, using one temporary array of the size of x.
+
+    Args:
+        x: float32 or float64 (capture, pixel) array. Overwritten
+        coefs: coefficients in increasing power order
+        dark: dark signal broadcastable to x
+
+    Returns:
+        x
+    """
+    x -= dark
+    x /= horner(coefs, x)
+    x += dark
+    return x
+
+
+@functools.lru_cache(maxsize=_LUT_CACHE_SIZE)
+def non_linearity_lut(coefs, dark, saturation, dtype='<f8'):
+    """Corrected value of every integer count from 0 to saturation.
+
+    Raw counts are integers bounded by the SaturationLevel, so for a constant
+    dark signal the correction of a batch is a single lookup. The most
+    recently used tables are cached by their arguments.
+
+    Args:
+        coefs (tuple): coefficients in increasing power order
+        dark (float): dark signal
+        saturation (int): SaturationLevel
+        dtype (str): dtype of the table
+
+    Returns:
+        read-only array of saturation + 1 values
+    """
+    counts = np.arange(saturation + 1, dtype=dtype)
+    lut = correct_non_linearity(counts, coefs, dark)
+    lut.flags.writeable = False
+    return lut
+
+
+def lookup_non_linearity(raw, coefs, dark, saturation, dtype='<f8'):
+    """Correct raw counts with a lookup table if they allow it.
+
+    Args:
+        raw: (capture, pixel) array of raw counts
+        coefs: coefficients in increasing power order
+        dark: (capture, 1) or (capture, pixel) dark signal
+        saturation (int): SaturationLevel
+
+    Returns:
+        corrected array, or None if the counts are not integers within
+        [0, saturation] or the dark signal is not constant
+    """
+    dark = np.asarray(dark)
+    if dark.size == 0 or np.any(dark != dark.flat[0]):
+        return None
+    if raw.dtype.kind not in 'ui':
+        if raw.dtype.kind != 'f' or not np.all(np.mod(raw, 1) == 0):
+            return None
+    if raw.size == 0 or raw.min() < 0 or raw.max() > saturation:
+        return None
+    lut = non_linearity_lut(tuple(float(c) for c in coefs),
+                            float(dark.flat[0]), int(saturation),
+                            np.dtype(dtype).str)
+    return lut.take(raw.astype(np.intp, copy=False))
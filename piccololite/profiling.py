@@ -0,0 +1,108 @@
+"""Per-stage timing hooks for reads and corrections
+"""
+import contextlib
+import time
+
+import pandas
+
+# callables of (stage, seconds, info). Instrumented code only reads the
+# clock when this is not empty
+_HOOKS = []
+
+
+def add_hook(hook):
+    """Register a callable to be called after each instrumented stage.
+
+    The hook is called as hook(stage, seconds, info) where info is a
+    dictionary of stage details (i.e. shape and nbytes of the stage output,
+    or the file read). Hooks are process local, so stages run in a process
+    pool are not recorded.
+
+    Args:
+        hook: callable
+    """
+    _HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    """Unregister a hook added with add_hook"""
+    _HOOKS.remove(hook)
+
+
+class Profiler:
+    """Hook collecting a record of every instrumented stage.
+
+    Attributes:
+        records (list): dictionaries of stage, seconds and stage details
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, stage, seconds, info):
+        record = {'stage': stage, 'seconds': seconds}
+        record.update(info)
+        self.records.append(record)
+
+    def to_dataframe(self):
+        """Returns the records as a pandas DataFrame"""
+        return pandas.DataFrame(self.records)
+
+    def summary(self):
+        """Returns the number of calls and total wall time per stage"""
+        df = self.to_dataframe()
+        if df.empty:
+            return df
+        out = df.groupby('stage', sort=False)['seconds'].agg(
+            ['count', 'sum', 'mean'])
+        if 'nbytes' in df:
+            out['nbytes'] = df.groupby('stage', sort=False)['nbytes'].sum()
+        return out.rename(columns={'sum': 'seconds', 'mean': 'mean_seconds'})
+
+
+@contextlib.contextmanager
+def profile():
+    """Context manager recording the stages run inside it.
+
+    Example:
+        with profile() as p:
+            seq = read_piccolo_sequence(path)
+            RadiometricCorrection(cals).transform(seq, batch=True)
+        print(p.summary())
+
+    Yields:
+        Profiler
+    """
+    profiler = Profiler()
+    add_hook(profiler)
+    try:
+        yield profiler
+    finally:
+        remove_hook(profiler)
+
+
+def enabled():
+    """True if any hooks are registered"""
+    return bool(_HOOKS)
+
+
+def clock():
+    return time.perf_counter()
+
+
+def record(stage, start, array=None, **info):
+    """Call the hooks with the time since start and return the clock.
+
+    Args:
+        stage (str): stage name
+        start (float): clock() at the start of the stage
+        array: output of the stage, for its shape and nbytes
+        info: other stage details
+    """
+    now = time.perf_counter()
+    if array is not None:
+        info['shape'] = tuple(array.shape)
+        info['nbytes'] = int(array.nbytes)
+    for hook in list(_HOOKS):
+        hook(stage, now - start, info)
+    return now
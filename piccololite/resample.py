@@ -0,0 +1,220 @@
+"""Wavelength resampling with precomputed interpolation weights
+"""
+import collections
+import threading
+
+import numpy as np
+import xarray
+
+# resamplers cached by source and target grid
+_CACHE = collections.OrderedDict()
+_CACHE_SIZE = 256
+_LOCK = threading.Lock()
+
+
+class LinearResampler:
+    """Linear interpolation from a source grid to a target grid.
+
+    The interpolation is held as index and weight pairs: each target value
+    is values[index] * (1 - weight) + values[index + 1] * weight. Targets
+    outside the source grid are NaN, as with xarray interp.
+
+    Attributes:
+        index: left source index of each target
+        weight: weight of the right source value of each target
+        valid: targets within the source grid
+    """
+
+    def __init__(self, source, target):
+        """
+        Args:
+            source: 1-D source grid
+            target: 1-D target grid
+        """
+        source = np.asarray(source, dtype=float)
+        target = np.asarray(target, dtype=float)
+        self.order = None
+        if np.any(np.diff(source) < 0):
+            self.order = np.argsort(source, kind='stable')
+            source = source[self.order]
+        n = len(source)
+        self.n_source = n
+        index = np.clip(np.searchsorted(source, target, side='right') - 1,
+                        0, max(n - 2, 0))
+        if n > 1:
+            span = source[index + 1] - source[index]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weight = np.where(span > 0, (target - source[index]) / span,
+                                  0.)
+        else:
+            weight = np.zeros(len(target))
+        self.valid = (target >= source[0]) & (target <= source[-1])
+        # exact matches of the last source value
+        self.weight = np.where(self.valid, np.clip(weight, 0, 1), 0.)
+        self.index = index
+        self._right = np.minimum(index + 1, n - 1)
+
+    def __call__(self, values):
+        """Resample values along the last axis.
+
+        Args:
+            values: array (..., source) i.e. a (capture, pixel) batch
+
+        Returns:
+            array (..., target)
+        """
+        values = np.asarray(values, dtype=float)
+        if values.shape[-1] != self.n_source:
+            raise ValueError('values have {} points, source grid has '
+                             '{}'.format(values.shape[-1], self.n_source))
+        if self.order is not None:
+            values = values.take(self.order, axis=-1)
+        left = values.take(self.index, axis=-1)
+        right = values.take(self._right, axis=-1)
+        # targets on a source point do not depend on their neighbours
+        out = np.where(self.weight == 0, left,
+                       left + (right - left) * self.weight)
+        out[..., ~self.valid] = np.nan
+        return out
+
+
+class BandResampler:
+    """Integration of spectra over sensor bands.
+
+    Each band is a spectral response function (SRF) on the source grid,
+    weighted by the width of each source pixel and normalised to sum to one,
+    so resampling a batch is one matrix product. Pixels that are NaN are
+    excluded and the remaining weights renormalised.
+
+    Attributes:
+        weights: (band, source) weights
+    """
+
+    def __init__(self, source, centers=None, fwhm=None, srf=None):
+        """
+        Args:
+            source: 1-D source grid
+            centers: band centre wavelengths, for Gaussian SRFs
+            fwhm: band full width at half maximum (scalar or per band), for
+                Gaussian SRFs
+            srf: alternatively, a DataArray of SRFs with band and wavelength
+                dimensions. SRFs are interpolated onto the source grid and
+                are zero outside their wavelength range
+        """
+        source = np.asarray(source, dtype=float)
+        if srf is not None:
+            response = get_resampler(srf['wavelength'].values, source)(
+                srf.transpose('band', 'wavelength').values)
+            response = np.nan_to_num(response)
+        elif centers is not None and fwhm is not None:
+            centers = np.asarray(centers, dtype=float)
+            sigma = np.broadcast_to(np.asarray(fwhm, dtype=float),
+                                    centers.shape) / (2 * np.sqrt(2 *
+                                                                  np.log(2)))
+            response = np.exp(-0.5 * ((source[np.newaxis, :] -
+                                       centers[:, np.newaxis]) /
+                                      sigma[:, np.newaxis]) ** 2)
+        else:
+            raise ValueError('Either centers and fwhm or srf are required')
+        width = np.gradient(source) if len(source) > 1 else np.ones(1)
+        weights = response * np.abs(width)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.weights = weights / weights.sum(axis=1, keepdims=True)
+
+    def __call__(self, values):
+        """Integrate values (..., source) over the bands (..., band)"""
+        values = np.asarray(values, dtype=float)
+        missing = np.isnan(values)
+        if not missing.any():
+            return values @ self.weights.T
+        total = (~missing).astype(float) @ self.weights.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(missing, 0, values) @ self.weights.T / total
+
+
+def get_resampler(source, target):
+    """Returns a cached LinearResampler from source to target.
+
+    Resamplers are cached by the bytes of both grids, so repeated resampling
+    between the same grids (i.e. calibration gains onto an instrument grid)
+    reuses the index and weights.
+
+    Args:
+        source: 1-D source grid
+        target: 1-D target grid
+    """
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    key = (source.tobytes(), target.tobytes())
+    try:
+        resampler = _CACHE[key]
+        with _LOCK:
+            _CACHE.move_to_end(key)
+        return resampler
+    except KeyError:
+        pass
+    resampler = LinearResampler(source, target)
+    with _LOCK:
+        _CACHE[key] = resampler
+        while len(_CACHE) > _CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return resampler
+
+
+def resample(x, wavelength):
+    """Linearly resample a DataArray onto new wavelengths.
+
+    Equivalent to x.interp(wavelength=wavelength) but the interpolation
+    weights are cached and a batch of spectra is resampled at once.
+
+    Args:
+        x: DataArray with a wavelength dimension (i.e. a (capture,
+            wavelength) batch)
+        wavelength: target wavelengths (array or DataArray)
+
+    Returns:
+        DataArray
+    """
+    target = np.asarray(getattr(wavelength, 'values', wavelength),
+                        dtype=float)
+    resampler = get_resampler(x['wavelength'].values, target)
+    return _apply(x, resampler, {'wavelength': target})
+
+
+def resample_to_bands(x, centers=None, fwhm=None, srf=None):
+    """Integrate a DataArray over sensor bands.
+
+    Args:
+        x: DataArray with a wavelength dimension
+        centers: band centre wavelengths, for Gaussian SRFs
+        fwhm: band full width at half maximum, for Gaussian SRFs
+        srf: alternatively, a DataArray of SRFs with band and wavelength
+            dimensions
+
+    Returns:
+        DataArray with wavelength (band centre) dimension
+    """
+    resampler = BandResampler(x['wavelength'].values, centers, fwhm, srf)
+    if srf is not None:
+        # response weighted centre of each band
+        centers = (resampler.weights * x['wavelength'].values).sum(axis=1)
+        coords = {'wavelength': centers}
+        if 'band' in srf.coords:
+            coords['band'] = ('wavelength', srf['band'].values)
+    else:
+        coords = {'wavelength': np.asarray(centers, dtype=float),
+                  'fwhm': ('wavelength', np.broadcast_to(
+                      np.asarray(fwhm, dtype=float), np.shape(centers)))}
+    return _apply(x, resampler, coords)
+
+
+# Private funcs
+def _apply(x, resampler, coords):
+    # apply along the wavelength dimension, keeping the other coordinates
+    dims = [d for d in x.dims if d != 'wavelength'] + ['wavelength']
+    x = x.transpose(*dims)
+    other = {k: v for k, v in x.coords.items()
+             if 'wavelength' not in v.dims}
+    other.update(coords)
+    return xarray.DataArray(resampler(x.values), dims=dims, coords=other,
+                            attrs=x.attrs, name=x.name)
@@ -0,0 +1,169 @@
+"""Online statistics for aggregating repeat measurements
+"""
+import numpy as np
+
+METRICS = ('mean', 'median', 'min', 'max', 'std', 'var')
+
+
+class RunningStatistics:
+    """Per-pixel statistics of spectra folded in one at a time.
+
+    Mean and variance are updated with Welford's algorithm and min/max are
+    tracked directly, so memory is independent of the number of spectra.
+    NaN values are ignored, as in the xarray reductions.
+
+    The median is estimated with the remedian: spectra are collected in a
+    buffer of median_buffer spectra, and each full buffer is reduced to its
+    median and passed up a level. The result is exact until more than
+    median_buffer spectra have been folded in and approximate afterwards,
+    with memory bounded by median_buffer * log(n) spectra.
+    """
+
+    def __init__(self, median=False, median_buffer=101):
+        """
+        Args:
+            median (bool): track the median
+            median_buffer (int): number of spectra held at each median level
+                (at least 2)
+        """
+        if median_buffer < 2:
+            raise ValueError('median_buffer must be at least 2')
+        self.wavelength = None
+        self.count = None
+        self._mean = None
+        self._m2 = None
+        self._min = None
+        self._max = None
+        self._median = median
+        self._median_buffer = median_buffer
+        self._levels = []
+
+    def update(self, values, wavelength):
+        """Fold in a spectrum.
+
+        Args:
+            values: 1-D array of values
+            wavelength: 1-D array of wavelengths of values. Spectra on
+                another grid are placed on the union of the grids
+        """
+        values = np.asarray(values, dtype=float)
+        wavelength = np.asarray(wavelength)
+        if self.wavelength is None:
+            self._initialise(wavelength)
+        elif wavelength is not self.wavelength and \
+                not np.array_equal(wavelength, self.wavelength):
+            values = self._regrid(values, wavelength)
+
+        valid = np.isfinite(values)
+        self.count += valid
+        delta = np.where(valid, values - self._mean, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._mean += np.where(valid, delta / self.count, 0)
+        self._m2 += np.where(valid, delta * (values - self._mean), 0)
+        self._min = np.fmin(self._min, values)
+        self._max = np.fmax(self._max, values)
+
+        if self._median:
+            self._push(0, values)
+
+    def result(self, metric):
+        """Returns the statistic as a 1-D array on self.wavelength
+
+        Args:
+            metric (str): mean, median, min, max, std or var
+        """
+        empty = self.count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if metric == 'mean':
+                out = self._mean.copy()
+            elif metric == 'var':
+                out = self._m2 / self.count
+            elif metric == 'std':
+                out = np.sqrt(self._m2 / self.count)
+            elif metric == 'min':
+                out = self._min.copy()
+            elif metric == 'max':
+                out = self._max.copy()
+            elif metric == 'median':
+                if not self._median:
+                    raise ValueError('median was not tracked')
+                out = self._get_median()
+            else:
+                raise ValueError('{} not a supported metric'.format(metric))
+        out[empty] = np.nan
+        return out
+
+    def _initialise(self, wavelength):
+        n = len(wavelength)
+        self.wavelength = wavelength
+        self.count = np.zeros(n, dtype=int)
+        self._mean = np.zeros(n)
+        self._m2 = np.zeros(n)
+        self._min = np.full(n, np.nan)
+        self._max = np.full(n, np.nan)
+
+    def _regrid(self, values, wavelength):
+        # move the state (and values) onto the union of the two grids
+        union = np.union1d(self.wavelength, wavelength)
+        old = np.searchsorted(union, self.wavelength)
+
+        def _expand(x, fill):
+            out = np.full(x.shape[:-1] + (len(union),), fill, dtype=x.dtype)
+            out[..., old] = x
+            return out
+
+        self.count = _expand(self.count, 0)
+        self._mean = _expand(self._mean, 0.)
+        self._m2 = _expand(self._m2, 0.)
+        self._min = _expand(self._min, np.nan)
+        self._max = _expand(self._max, np.nan)
+        self._levels = [[_expand(x, np.nan) for x in level]
+                        for level in self._levels]
+        self.wavelength = union
+
+        out = np.full(len(union), np.nan)
+        out[np.searchsorted(union, wavelength)] = values
+        return out
+
+    def _push(self, level, values):
+        if level == len(self._levels):
+            self._levels.append([])
+        self._levels[level].append(values)
+        if len(self._levels[level]) == self._median_buffer:
+            full = np.stack(self._levels[level])
+            self._levels[level] = []
+            with np.errstate(invalid='ignore'):
+                self._push(level + 1, _nanmedian(full))
+
+    def _get_median(self):
+        if len(self._levels) == 1:
+            # nothing has been reduced yet so the median is exact
+            return _nanmedian(np.stack(self._levels[0]))
+        # weighted median of the partially filled levels
+        values = []
+        weights = []
+        for i, level in enumerate(self._levels):
+            values.extend(level)
+            weights.extend([self._median_buffer ** i] * len(level))
+        return _weighted_median(np.stack(values), np.array(weights, float))
+
+
+def _nanmedian(x):
+    # all-NaN columns are expected where grids do not overlap
+    out = np.full(x.shape[1:], np.nan)
+    valid = np.isfinite(x).any(axis=0)
+    out[valid] = np.nanmedian(x[:, valid], axis=0)
+    return out
+
+
+def _weighted_median(values, weights):
+    # per column weighted median of values (n, pixels), ignoring NaN
+    w = np.where(np.isfinite(values), weights[:, np.newaxis], 0)
+    order = np.argsort(np.where(np.isfinite(values), values, np.inf), axis=0)
+    values = np.take_along_axis(values, order, axis=0)
+    cumulative = np.cumsum(np.take_along_axis(w, order, axis=0), axis=0)
+    total = cumulative[-1]
+    idx = np.argmax(cumulative >= total / 2, axis=0)
+    out = values[idx, np.arange(values.shape[1])]
+    out[total == 0] = np.nan
+    return out
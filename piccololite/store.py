@@ -0,0 +1,369 @@
+"""Columnar, memory-mapped storage of Piccolo sequences
+"""
+import functools
+import json
+import logging
+import os
+import numpy as np
+import pandas
+import xarray
+
+from ._parallel import import_dask, is_dask_array
+from .compact import sequence_to_xarray
+
+_MANIFEST = 'manifest.json'
+_DATA = 'data.bin'
+_DTYPE = '<f8'
+# capture label column (filename without the .pico extension)
+_CAPTURE = 'capture'
+_NUMBER = (int, float, np.integer, np.floating)
+_INTEGER = (int, np.integer)
+
+
+class SequenceStore:
+    """Contiguous on-disk store for a Piccolo sequence.
+
+    All spectra for each serial/direction are held in a single (capture,
+    pixel) array and each item of metadata that varies between captures
+    (i.e. Datetime, temperatures, Batch, SequenceNumber) is held as a 1-D
+    column. Metadata that is constant is stored once. Arrays are opened
+    memory-mapped, so selecting a subset of captures only reads the bytes
+    it touches.
+
+    Layout:
+        path/manifest.json
+        path/<serial>_<direction>/data.bin (raw float64, capture x pixel)
+        path/<serial>_<direction>/wavelength.npy, pixel.npy
+        path/<serial>_<direction>/<column>.bin
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): store directory (created on first append)
+        """
+        self.path = os.path.abspath(path)
+        try:
+            with open(os.path.join(self.path, _MANIFEST), 'r') as f:
+                self._manifest = json.load(f)
+        except FileNotFoundError:
+            self._manifest = {'streams': {}}
+
+    def __len__(self):
+        """Number of captures in the largest stream"""
+        return max([s['n_captures'] for s in self.streams.values()] or [0])
+
+    @property
+    def streams(self):
+        return self._manifest['streams']
+
+    def append(self, piccolo_sequence):
+        """Append a sequence to the store.
+
+        Args:
+            piccolo_sequence: nested dictionary of piccolo spectra in the
+                form [filename][instrument][direction]
+        """
+        piccolo_sequence = sequence_to_xarray(piccolo_sequence)
+        for (serial, direction), (labels, spectra) in _group_sequence(
+                piccolo_sequence).items():
+            self._append_stream(serial, direction, labels, spectra)
+        self._write_manifest()
+
+    def to_datasets(self):
+        """Open the store as memory-mapped xarray Datasets.
+
+        Returns:
+            dictionary of xarray Datasets keyed by instrument serial. Each
+            direction is a (capture, wavelength) variable; per-capture
+            metadata are capture coordinates prefixed with the direction.
+        """
+        out = {}
+        for name, stream in self.streams.items():
+            root = os.path.join(self.path, name)
+            n = stream['n_captures']
+            data = np.memmap(os.path.join(root, _DATA), dtype=_DTYPE,
+                             mode='r', shape=(n, stream['n_pixels']))
+            columns = {k: self._open_column(root, k, dtype, n)
+                       for k, dtype in stream['columns'].items()}
+            arr = _spectra_to_dataarray(
+                data, np.load(os.path.join(root, 'wavelength.npy')),
+                np.load(os.path.join(root, 'pixel.npy')),
+                columns.pop(_CAPTURE), columns, stream['attrs'],
+                stream['direction'])
+            out.setdefault(stream['serial'], {})[stream['direction']] = arr
+        return {k: _merge_directions(v) for k, v in out.items()}
+
+    def _open_column(self, root, key, dtype, n):
+        fpath = os.path.join(root, _column_filename(key))
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(fpath, dtype=dtype, mode='r', shape=(n,))
+
+    def _append_stream(self, serial, direction, labels, spectra):
+        name = '{}_{}'.format(serial, direction)
+        root = os.path.join(self.path, name)
+        data, wavelength, pixel = _stack_spectra(spectra)
+        data = np.asarray(data)
+        attrs = [_jsonable_attrs(x.attrs) for x in spectra]
+
+        stream = self.streams.get(name)
+        if stream is None:
+            os.makedirs(root, exist_ok=True)
+            np.save(os.path.join(root, 'wavelength.npy'), wavelength)
+            np.save(os.path.join(root, 'pixel.npy'), pixel)
+            constant, columns = _split_attrs(attrs)
+            stream = {'serial': serial, 'direction': direction,
+                      'n_captures': 0, 'n_pixels': data.shape[1],
+                      'attrs': constant, 'columns': {}}
+            columns[_CAPTURE] = np.array(labels)
+            self.streams[name] = stream
+        else:
+            _wavelength = np.load(os.path.join(root, 'wavelength.npy'))
+            if data.shape[1] != stream['n_pixels'] or \
+                    not np.allclose(_wavelength, wavelength):
+                raise ValueError('Wavelength grid of {} differs from the '
+                                 'store'.format(name))
+            columns = self._promote_columns(root, stream, attrs)
+            columns[_CAPTURE] = np.array(labels)
+
+        n = stream['n_captures']
+        # discard anything left over from an interrupted append
+        _write_rows(os.path.join(root, _DATA), data.astype(_DTYPE),
+                    n * stream['n_pixels'] * np.dtype(_DTYPE).itemsize)
+        for k, values in columns.items():
+            self._append_column(root, stream, k, values, n)
+        stream['n_captures'] = n + data.shape[0]
+        logging.debug('{} captures appended to {}'.format(len(data), name))
+
+    def _promote_columns(self, root, stream, attrs):
+        # find new values for existing columns and promote any constants that
+        # now vary (or keys not seen before) to columns
+        n = stream['n_captures']
+        keys = set(stream['attrs']) | set(stream['columns']) | \
+            set(k for a in attrs for k in a)
+        keys.discard(_CAPTURE)
+        out = {}
+        for k in sorted(keys):
+            values = [a.get(k) for a in attrs]
+            if k in stream['columns']:
+                out[k] = values
+            elif k in stream['attrs'] and \
+                    all(_equal(v, stream['attrs'][k]) for v in values):
+                continue
+            else:
+                previous = stream['attrs'].pop(k, None)
+                self._write_column(root, stream, k,
+                                   _to_column(k, [previous] * n + values))
+        return out
+
+    def _append_column(self, root, stream, key, values, n):
+        if key not in stream['columns']:
+            self._write_column(root, stream, key, _to_column(key, values))
+            return
+        dtype = np.dtype(stream['columns'][key])
+        values = _to_column(key, values)
+        fpath = os.path.join(root, _column_filename(key))
+        if np.can_cast(values.dtype, dtype, 'safe'):
+            _write_rows(fpath, values.astype(dtype), n * dtype.itemsize)
+            return
+        # rewrite the column with a type that can hold the new values
+        try:
+            common = np.promote_types(dtype, values.dtype)
+        except TypeError:
+            common = np.dtype(str)
+        old = np.fromfile(fpath, dtype=dtype, count=n)
+        self._write_column(root, stream, key, np.concatenate(
+            [old.astype(common), values.astype(common)]))
+
+    def _write_column(self, root, stream, key, values):
+        values.tofile(os.path.join(root, _column_filename(key)))
+        stream['columns'][key] = values.dtype.str
+
+    def _write_manifest(self):
+        fpath = os.path.join(self.path, _MANIFEST)
+        with open(fpath + '.tmp', 'w') as f:
+            json.dump(self._manifest, f, indent=1)
+        os.replace(fpath + '.tmp', fpath)
+
+
+def sequence_to_store(piccolo_sequence, path):
+    """Writes a Piccolo sequence dictionary to a SequenceStore.
+
+    Captures are appended if the store already exists.
+
+    Args:
+        piccolo_sequence: nested dictionary of piccolo spectra.
+            Must be in the form [filename][instrument][direction]
+        path (str): destination directory
+
+    Returns:
+        SequenceStore
+    """
+    store = SequenceStore(path)
+    store.append(piccolo_sequence)
+    return store
+
+
+def open_sequence_store(path):
+    """Opens a SequenceStore as memory-mapped xarray Datasets.
+
+    Args:
+        path (str): store directory
+
+    Returns:
+        dictionary of xarray Datasets keyed by instrument serial
+    """
+    return SequenceStore(path).to_datasets()
+
+
+# Private funcs
+def _group_sequence(piccolo_sequence):
+    # {(serial, direction): ([capture labels], [spectra])} in sequence order
+    out = {}
+    for fname, f in piccolo_sequence.items():
+        label = fname.split('.pico')[0]
+        for serial, directions in f.items():
+            for direction, arr in directions.items():
+                if arr is None:
+                    continue
+                labels, spectra = out.setdefault((serial, direction), ([], []))
+                labels.append(label)
+                spectra.append(arr)
+    return out
+
+
+def _stack_spectra(spectra, join='exact'):
+    # (capture, pixel) array, wavelength and pixel coordinates of 1-D spectra.
+    # With join='outer' spectra on other grids are placed on the union of
+    # the wavelength grids (missing values are NaN) as xarray.merge would
+    first = spectra[0]
+    wavelength = np.asarray(first['wavelength'].values)
+    matching = [x.shape == first.shape and
+                np.array_equal(x['wavelength'].values, wavelength)
+                for x in spectra]
+    lazy = any(is_dask_array(x.data) for x in spectra)
+    if all(matching):
+        if lazy:
+            data = import_dask().array.stack([x.data for x in spectra])
+        else:
+            data = np.stack([np.asarray(x.values) for x in spectra])
+        if 'pixel' in first.coords:
+            pixel = np.asarray(first['pixel'].values)
+        else:
+            pixel = np.arange(len(wavelength))
+        return data, wavelength, pixel
+
+    if join != 'outer':
+        raise ValueError('Spectra must share a wavelength grid to be stacked')
+    wavelength = functools.reduce(
+        np.union1d, [x['wavelength'].values for x in spectra])
+    if lazy:
+        data = import_dask().array.stack(
+            [x.reindex(wavelength=wavelength).data for x in spectra])
+    else:
+        data = np.full((len(spectra), len(wavelength)), np.nan)
+        for row, x in zip(data, spectra):
+            row[np.searchsorted(wavelength, x['wavelength'].values)] = \
+                x.values
+    # pixel indices are not meaningful on a combined grid
+    pixel = np.full(len(wavelength), -1)
+    return data, wavelength, pixel
+
+
+def _split_attrs(attrs):
+    # split a list of attribute dicts into constant and per-capture columns
+    keys = []
+    for a in attrs:
+        keys.extend(k for k in a if k not in keys)
+    constant = {}
+    columns = {}
+    for k in keys:
+        values = [a.get(k) for a in attrs]
+        if all(k in a for a in attrs) and \
+                all(_equal(v, values[0]) for v in values):
+            constant[k] = values[0]
+        else:
+            columns[k] = _to_column(k, values)
+    return constant, columns
+
+
+def _to_column(key, values):
+    # convert a list of attribute values to a 1-D array
+    if isinstance(values, np.ndarray):
+        return values
+    if key == 'Datetime':
+        return _to_datetime(values)
+    if any(isinstance(v, (list, dict, np.ndarray)) for v in values):
+        # non-scalar metadata is stored as json text
+        return np.array([json.dumps(_jsonable(v)) for v in values])
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, (bool, np.bool_)) for v in present):
+        if len(present) == len(values):
+            return np.array(values, dtype='?')
+    elif present and all(isinstance(v, _NUMBER) for v in present):
+        if len(present) == len(values) and \
+                all(isinstance(v, _INTEGER) for v in present):
+            return np.array(values, dtype='<i8')
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype='<f8')
+    return np.array(['' if v is None else str(v) for v in values])
+
+
+def _to_datetime(values):
+    # ISO 8601 timestamps in UTC to naive datetime64
+    try:
+        times = pandas.to_datetime(values, utc=True, format='ISO8601')
+    except (TypeError, ValueError):
+        times = pandas.to_datetime(values, utc=True)
+    return np.asarray(times.tz_convert(None), dtype='<M8[ns]')
+
+
+def _spectra_to_dataarray(data, wavelength, pixel, labels, columns, attrs,
+                          direction):
+    coords = {
+        'capture': ('capture', labels),
+        'wavelength': ('wavelength', wavelength),
+        'pixel': ('wavelength', pixel)
+    }
+    for k, v in columns.items():
+        coords['{}_{}'.format(direction, k)] = ('capture', v)
+    return xarray.DataArray(data, dims=('capture', 'wavelength'),
+                            coords=coords, attrs=attrs)
+
+
+def _merge_directions(arrays):
+    # one Dataset per instrument with a variable per direction
+    return xarray.Dataset({k: arrays[k] for k in sorted(arrays)})
+
+
+def _jsonable_attrs(attrs):
+    return {k: _jsonable(v) for k, v in attrs.items()}
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _equal(a, b):
+    try:
+        return bool(a == b) and type(a) == type(b)
+    except ValueError:
+        return bool(np.array_equal(a, b))
+
+
+def _write_rows(fpath, values, offset):
+    # write values at byte offset, truncating anything beyond it
+    mode = 'r+b' if os.path.exists(fpath) else 'wb'
+    with open(fpath, mode) as f:
+        f.truncate(offset)
+        f.seek(offset)
+        values.tofile(f)
+
+
+def _column_filename(key):
+    return '{}.bin'.format(key)
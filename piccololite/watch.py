@@ -0,0 +1,172 @@
+"""Incremental correction of .pico files as they are written
+"""
+import logging
+import os
+import time
+
+from .correct import RadiometricCorrection
+from .io import read_piccolo_file, _index_files
+from .store import SequenceStore
+
+# nanoseconds
+_MTIME_RESOLUTION = 2 * 10 ** 9
+
+
+class SequenceWatcher:
+    """Corrects new .pico files in a directory as they land.
+
+    The watcher keeps track of the files it has already processed, so each
+    update only parses files that are new. Files are processed in batch and
+    sequence number order: a new _dark file becomes the dark reference for
+    the light files that follow it, and light files that arrive before any
+    dark file are held back until one does. Files that cannot be read yet
+    (i.e. are still being written) are retried on the next update. A file
+    that fails max_attempts updates in a row without its size or modification
+    time changing is corrupt: it is added to failed and only retried if it
+    changes again.
+
+    Corrected spectra are appended to output, which can be a SequenceStore
+    (or its path) or any object with an append(piccolo_sequence) method.
+    """
+
+    def __init__(self, directory, correction=None, output=None, batch=True,
+                 max_attempts=3, **kwargs):
+        """
+        Args:
+            directory (str): directory the Piccolo writes .pico files to
+            correction: a RadiometricCorrection. If None, a correction
+                without calibration files is used
+            output: SequenceStore, store path or object with an append method
+            batch (bool): correct new spectra in batch mode
+            max_attempts (int): failed reads of an unchanged file before it
+                is given up on
+
+        Kwargs are supplied to read_piccolo_file
+        """
+        self.directory = directory
+        self.correction = correction or RadiometricCorrection()
+        if isinstance(output, str):
+            output = SequenceStore(output)
+        self.output = output
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.processed = set()
+        self.failed = {}
+        self.dark_file = None
+        self._kwargs = kwargs
+        self._pending = {}
+        self._last_mtime = None
+        self._last_scan = 0
+        self._retry = False
+        self._attempts = {}
+
+    def update(self):
+        """Process any new files.
+
+        Returns:
+            dictionary of the corrected light files, keyed by filename
+        """
+        # skip the listing if nothing has been added to the directory. The
+        # modification time is only trusted once it is older than the
+        # timestamp resolution of the previous listing
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self._last_mtime and not self._retry and \
+                mtime < self._last_scan - _MTIME_RESOLUTION:
+            return {}
+        self._last_mtime = mtime
+        self._last_scan = time.time_ns()
+        self._retry = False
+
+        new = [os.path.join(self.directory, x)
+               for x in os.listdir(self.directory)
+               if x.endswith('.pico') and x not in self.processed and
+               not self._gave_up(x)]
+        index = _index_files(new).sort_values(
+            ['Batch', 'SequenceNumber', 'Type'])
+
+        corrected = {}
+        for fname, row in index.iterrows():
+            try:
+                data = read_piccolo_file(row['Path'], **self._kwargs)
+            except (ValueError, KeyError, OSError) as e:
+                if self._failed_attempt(fname, row['Path']):
+                    logging.warning('{} could not be read after {} attempts, '
+                                    'skipping: {}'.format(
+                                        fname, self.max_attempts, e))
+                    self.failed[fname] = e
+                else:
+                    logging.debug('{} not read yet: {}'.format(fname, e))
+                    self._retry = True
+                continue
+            self._attempts.pop(fname, None)
+            self.failed.pop(fname, None)
+            self.processed.add(fname)
+            if row['Type'] == 'dark' or '_dark' in fname:
+                # light files waiting for a dark reference are corrected
+                # with the first dark to arrive, as in transform
+                if self.dark_file is not None:
+                    corrected.update(self._flush())
+                self.correction.set_dark_reference({fname: data}, fname)
+                self.dark_file = fname
+            else:
+                self._pending[fname] = data
+
+        if self.dark_file is not None:
+            corrected.update(self._flush())
+        return corrected
+
+    def watch(self, interval=5, callback=None, timeout=None):
+        """Poll the directory, correcting new files as they land.
+
+        Args:
+            interval (float): seconds between polls
+            callback: called with the output of each update that corrected
+                one or more files
+            timeout (float): stop after this many seconds (default: never)
+        """
+        start = time.monotonic()
+        while timeout is None or time.monotonic() - start < timeout:
+            corrected = self.update()
+            if corrected and callback is not None:
+                callback(corrected)
+            time.sleep(interval)
+
+    def _failed_attempt(self, fname, path):
+        # count failed reads of a file while its size and modification time
+        # are unchanged. Returns True once the file should be given up on
+        stat = _stat(path)
+        last, attempts = self._attempts.get(fname, (None, 0))
+        attempts = attempts + 1 if stat == last else 1
+        self._attempts[fname] = (stat, attempts)
+        return attempts >= self.max_attempts
+
+    def _gave_up(self, fname):
+        # failed files are retried if they have changed since
+        if fname not in self.failed:
+            return False
+        path = os.path.join(self.directory, fname)
+        if _stat(path) == self._attempts[fname][0]:
+            return True
+        del self.failed[fname]
+        return False
+
+    def _flush(self):
+        # correct and output the light files read since the last dark
+        if not self._pending:
+            return {}
+        corrected = self.correction.apply(self._pending, self.batch)
+        self._pending = {}
+        if self.output is not None:
+            self.output.append(corrected)
+        logging.debug('{} files corrected'.format(len(corrected)))
+        return corrected
+
+
+# Private funcs
+def _stat(path):
+    # size and modification time, or None if the file has gone
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
@@ -21,7 +21,14 @@ setuptools.setup(
         'scipy',
         'netcdf4'
     ],
+    extras_require={
+        'dask': ['dask'],
+        'zarr': ['zarr']
+    },
     scripts=[],
+    entry_points={
+        'console_scripts': ['piccololite-convert=piccololite.cli:main']
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU License",
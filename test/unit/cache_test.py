@@ -0,0 +1,67 @@
+from piccololite import read_piccolo_file, read_piccolo_sequence, PicoCache
+
+import os
+import shutil
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FNAME = 'b000000_s000005_light.pico'
+
+
+def test_cache_read(tmp_path):
+    cache = PicoCache(str(tmp_path / 'cache'))
+    fpath = os.path.join(HERE, 'data', FNAME)
+    ds1 = read_piccolo_file(fpath, cache=cache)
+    assert cache.get(fpath) is not None
+    ds2 = read_piccolo_file(fpath, cache=cache)
+    ds3 = read_piccolo_file(fpath)
+    for ser in ds3:
+        for _dir in ds3[ser]:
+            for ds in [ds1, ds2]:
+                assert ds[ser][_dir].identical(ds3[ser][_dir])
+
+
+def test_cache_sequence(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'), cache=cache_dir)
+    assert len(os.listdir(cache_dir)) == len(_ds)
+    _ds2 = read_piccolo_sequence(os.path.join(HERE, 'data'), cache=cache_dir)
+    np.testing.assert_array_equal(_ds[FNAME]['QEP00984']['Upwelling'],
+                                  _ds2[FNAME]['QEP00984']['Upwelling'])
+
+
+def test_cache_invalidation(tmp_path):
+    fpath = str(tmp_path / FNAME)
+    shutil.copy(os.path.join(HERE, 'data', FNAME), fpath)
+    cache = PicoCache(str(tmp_path / 'cache'))
+    read_piccolo_file(fpath, cache=cache)
+    assert cache.get(fpath) is not None
+    stat = os.stat(fpath)
+    os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.get(fpath) is None
+
+
+def test_cache_eviction(tmp_path):
+    fpath = os.path.join(HERE, 'data', FNAME)
+    cache = PicoCache(str(tmp_path / 'cache'), max_size=1)
+    read_piccolo_file(fpath, cache=cache)
+    assert cache.get(fpath) is None
+    assert os.listdir(str(tmp_path / 'cache')) == []
+
+
+def test_cache_size_accounting(tmp_path, monkeypatch):
+    scans = []
+    get_total_size = PicoCache._get_total_size
+    monkeypatch.setattr(PicoCache, '_get_total_size',
+                        lambda self: scans.append(1) or get_total_size(self))
+    cache_dir = str(tmp_path / 'cache')
+    read_piccolo_sequence(os.path.join(HERE, 'data'), cache=cache_dir)
+    # one scan per sequence, not per file
+    assert len(scans) == 1
+
+    cache = PicoCache(cache_dir)
+    fpath = os.path.join(HERE, 'data', FNAME)
+    size = cache._size
+    # overwriting an entry does not count it twice
+    cache.put(fpath, cache.get(fpath))
+    assert cache._size == size == get_total_size(cache)
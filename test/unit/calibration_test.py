@@ -1,7 +1,10 @@
-from piccololite import generate_calibration
+from piccololite import generate_calibration, generate_calibrations, \
+calibration_to_csv, read_piccolo_sequence, RadiometricCorrection
 
 import os
 import json
+import numpy as np
+import xarray
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 
@@ -10,3 +13,43 @@ def test_calibrate_simple():
     refpath = os.path.join(dpath, 'F1380_irradiance.nc')
     c = generate_calibration(dpath, refpath)
     assert len(c) == 2
+
+def test_calibrate_lazy():
+    dpath = os.path.join(HERE, 'data')
+    refpath = os.path.join(dpath, 'F1380_irradiance.nc')
+    c = generate_calibration(read_piccolo_sequence(dpath, lazy=True), refpath)
+    assert len(c) == 2
+
+def test_calibrate_batch(tmp_path, read_run):
+    dpath = os.path.join(HERE, 'data')
+    refpath = os.path.join(dpath, 'F1380_irradiance.nc')
+    seq = read_run()
+    reference = xarray.load_dataarray(refpath)
+    radiance = reference.copy()
+    radiance.attrs['SourceType'] = 'absolute radiance'
+    # the same sequence is corrected once for both references
+    c = generate_calibrations([(seq, refpath), (seq, radiance)])
+    assert set(c) == {'QEP00984', 'FLMS01691'}
+    assert set(c['QEP00984']) == {'Downwelling', 'Upwelling'}
+    single = generate_calibration(seq, refpath)
+    np.testing.assert_allclose(c['QEP00984']['Downwelling'],
+                               single['QEP00984'], rtol=1e-9)
+    assert c['QEP00984']['Upwelling'].attrs['CalibrationDirection'] == \
+        'Upwelling'
+
+    paths = calibration_to_csv(c, str(tmp_path))
+    assert sorted(os.path.basename(x) for x in paths) == \
+        ['FLMS01691_CalCoeffs.csv', 'QEP00984_CalCoeffs.csv']
+    r = RadiometricCorrection(paths)
+    x = r.transform(seq)
+    assert len(x) == len(seq)
+
+def test_calibrate_sessions():
+    dpath = os.path.join(HERE, 'data')
+    refpath = os.path.join(dpath, 'F1380_irradiance.nc')
+    c = generate_calibrations([(dpath, refpath),
+                               (read_piccolo_sequence(dpath), refpath)])
+    assert c['FLMS01691']['Downwelling'].attrs['CalibrationSessions'] == 2
+    single = generate_calibration(dpath, refpath)
+    np.testing.assert_allclose(c['FLMS01691']['Downwelling'],
+                               single['FLMS01691'], rtol=1e-9)
@@ -0,0 +1,70 @@
+from piccololite.cli import main
+
+import glob
+import os
+import pytest
+import shutil
+import xarray
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+cals = ['FLMS01691_CalCoeffs.csv', 'QEP00984_CalCoeffs.csv']
+cal_paths = [os.path.join(HERE, 'data', x) for x in cals]
+
+
+def _make_runs(tmp_path, n):
+    runs = []
+    for i in range(n):
+        run = tmp_path / 'runs' / 'run{}'.format(i)
+        run.mkdir(parents=True)
+        for f in glob.glob(os.path.join(HERE, 'data', 'b000000_s00000*')):
+            shutil.copy(f, str(run))
+        runs.append(str(run))
+    return runs
+
+
+def test_convert(tmp_path, capsys):
+    runs = _make_runs(tmp_path, 2)
+    out = str(tmp_path / 'out')
+    args = runs + ['-c'] + cal_paths + ['-o', out, '-j', '2']
+    assert main(args) == 0
+    assert sorted(os.listdir(out)) == [
+        'run0_FLMS01691.nc', 'run0_QEP00984.nc',
+        'run1_FLMS01691.nc', 'run1_QEP00984.nc']
+    assert '2 converted' in capsys.readouterr().out
+    with xarray.open_dataset(os.path.join(out, 'run0_QEP00984.nc')) as ds:
+        assert 'b000000_s000004_light_QEP00984_Upwelling' in ds
+
+    # outputs are up to date until a run changes
+    assert main(args) == 0
+    assert '0 converted, 2 up to date' in capsys.readouterr().out
+    os.utime(os.path.join(runs[1], 'b000000_s000004_light.pico'),
+             (2e9, 2e9))
+    assert main(args) == 0
+    assert '1 converted, 1 up to date' in capsys.readouterr().out
+    # or the options change
+    assert main(args + ['-a', 'mean']) == 0
+    assert '2 converted' in capsys.readouterr().out
+    with xarray.open_dataset(os.path.join(out, 'run0_QEP00984.nc')) as ds:
+        assert ds['Upwelling'].attrs['AggregationMetric'] == 'mean'
+
+
+def test_convert_duplicate_names(tmp_path):
+    runs = _make_runs(tmp_path, 1)
+    other = tmp_path / 'other' / 'run0'
+    shutil.copytree(runs[0], str(other))
+    with pytest.raises(SystemExit):
+        main(runs + [str(other), '-o', str(tmp_path / 'out')])
+    assert not os.path.exists(str(tmp_path / 'out'))
+
+
+def test_convert_aggregate_and_failure(tmp_path, capsys):
+    runs = _make_runs(tmp_path, 1)
+    empty = tmp_path / 'runs' / 'empty'
+    empty.mkdir()
+    out = str(tmp_path / 'out')
+    assert main(runs + [str(empty), '-o', out, '-a', 'mean', '-j', '1']) == 1
+    captured = capsys.readouterr()
+    assert '1 converted, 0 up to date, 1 failed' in captured.out
+    assert 'empty' in captured.err
+    with xarray.open_dataset(os.path.join(out, 'run0_QEP00984.nc')) as ds:
+        assert ds['Upwelling'].attrs['AggregationMetric'] == 'mean'
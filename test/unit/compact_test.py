@@ -0,0 +1,62 @@
+from piccololite import read_piccolo_sequence, read_piccolo_file, \
+RadiometricCorrection, CompactSpectrum, sequence_to_xarray, \
+sequence_to_datasets
+
+import os
+import numpy as np
+import pytest
+import xarray
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+cals = ['FLMS01691_CalCoeffs.csv', 'QEP00984_CalCoeffs.csv']
+cal_paths = [os.path.join(HERE, 'data', x) for x in cals]
+
+
+def test_compact_read():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    compact = read_piccolo_sequence(os.path.join(HERE, 'data'), compact=True)
+    a = compact['b000000_s000001_light.pico']['QEP00984']['Upwelling']
+    b = compact['b000000_s000002_light.pico']['QEP00984']['Upwelling']
+    assert isinstance(a, CompactSpectrum)
+    assert a.counts.dtype == np.uint32
+    # instrument metadata is shared
+    assert a.instrument is b.instrument
+    assert a.metadata['Datetime'] != b.metadata['Datetime']
+    # and converted back to the DataArrays of the default read
+    x = sequence_to_xarray(compact)
+    for fn in _ds:
+        for ser in _ds[fn]:
+            for dirs in _ds[fn][ser]:
+                xarray.testing.assert_identical(x[fn][ser][dirs],
+                                                _ds[fn][ser][dirs])
+                assert list(x[fn][ser][dirs].attrs) == \
+                    list(_ds[fn][ser][dirs].attrs)
+    with pytest.raises(ValueError):
+        read_piccolo_file(os.path.join(HERE, 'data',
+                                       'b000000_s000001_light.pico'),
+                          assign_coords=['Dark'], compact=True)
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_compact_transform(batch):
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    compact = read_piccolo_sequence(os.path.join(HERE, 'data'), compact=True)
+    r = RadiometricCorrection(cal_paths)
+    x1 = r.transform(_ds)
+    x2 = r.transform(compact, batch=batch)
+    fn = 'b000000_s000004_light.pico'
+    for ser in x1[fn]:
+        for dirs in x1[fn][ser]:
+            a = x1[fn][ser][dirs]
+            b = x2[fn][ser][dirs]
+            assert isinstance(b, xarray.DataArray)
+            xarray.testing.assert_equal(a, b)
+            assert a.attrs.keys() == b.attrs.keys()
+
+
+def test_compact_datasets():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    compact = read_piccolo_sequence(os.path.join(HERE, 'data'), compact=True)
+    xarray.testing.assert_identical(
+        sequence_to_datasets(compact, layout='capture')['FLMS01691'],
+        sequence_to_datasets(_ds, layout='capture')['FLMS01691'])
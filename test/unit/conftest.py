@@ -0,0 +1,21 @@
+from piccololite import read_piccolo_sequence
+
+import os
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def read_run():
+    """Returns a function reading the test data of a single run.
+
+    Kwargs of the function are supplied to read_piccolo_sequence.
+    """
+    def _read_run(**kwargs):
+        # b000000_s000010_light.pico is from a different run and wavelength
+        # grid
+        seq = read_piccolo_sequence(os.path.join(HERE, 'data'), **kwargs)
+        seq.pop('b000000_s000010_light.pico')
+        return seq
+    return _read_run
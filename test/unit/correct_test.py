@@ -1,5 +1,9 @@
-from piccololite import read_piccolo_sequence, RadiometricCorrection
+from piccololite import read_piccolo_sequence, RadiometricCorrection, \
+sequence_to_netcdf
 import os
+import numpy as np
+import pytest
+import xarray
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 cals = ['FLMS01691_CalCoeffs.csv', 'QEP00984_CalCoeffs.csv']
@@ -44,3 +48,155 @@ def test_transform_alternative_dark():
     ser = 'QEP00984'
     dirs = 'Downwelling'
     assert (x1[fn][ser][dirs] != x2[fn][ser][dirs]).any()
+
+def test_transform_batch():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    r = RadiometricCorrection(cal_paths)
+    x1 = r.transform(_ds)
+    x2 = r.transform(_ds, batch=True)
+    assert list(x1) == list(x2)
+    for fn in x1:
+        for ser in x1[fn]:
+            for dirs in x1[fn][ser]:
+                a = x1[fn][ser][dirs]
+                b = x2[fn][ser][dirs]
+                np.testing.assert_allclose(a.values, b.values)
+                np.testing.assert_array_equal(a.wavelength, b.wavelength)
+                assert a.attrs['DarkSignal'] == b.attrs['DarkSignal']
+
+def test_transform_lazy():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    _lazy = read_piccolo_sequence(os.path.join(HERE, 'data'), lazy=True,
+                                  cache_size=1)
+    r = RadiometricCorrection(cal_paths)
+    x1 = r.transform(_ds)
+    x2 = r.transform(_lazy)
+    fn = 'b000000_s000000_light.pico'
+    np.testing.assert_allclose(x1[fn]['QEP00984']['Downwelling'],
+                               x2[fn]['QEP00984']['Downwelling'])
+
+def test_correction_plans_cached():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    r = RadiometricCorrection(cal_paths)
+    r.transform(_ds)
+    plans = dict(r._plans)
+    # 2 instruments x 2 directions x 2 wavelength calibrations
+    assert len(plans) == 8
+    r.transform(_ds, batch=True)
+    assert all(r._plans[k] is v for k, v in plans.items())
+    assert len(r._plans) == 8
+
+def test_transform_dask(tmp_path):
+    pytest.importorskip('dask')
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    _lazy = read_piccolo_sequence(os.path.join(HERE, 'data'), dask=True)
+    r = RadiometricCorrection(cal_paths)
+    x1 = r.transform(_ds, batch=True)
+    x2 = r.transform(_lazy, batch=True)
+    fn = 'b000000_s000000_light.pico'
+    assert x2[fn]['QEP00984']['Downwelling'].chunks is not None
+    np.testing.assert_allclose(x1[fn]['QEP00984']['Downwelling'],
+                               x2[fn]['QEP00984']['Downwelling'].compute())
+    # computed on write
+    delayed = sequence_to_netcdf(x2, str(tmp_path / 'lazy.nc'),
+                                 layout='capture', compute=False)
+    for d in delayed:
+        d.compute()
+    sequence_to_netcdf(x1, str(tmp_path / 'eager.nc'), layout='capture')
+    with xarray.open_dataset(str(tmp_path / 'lazy_QEP00984.nc')) as a, \
+            xarray.open_dataset(str(tmp_path / 'eager_QEP00984.nc')) as b:
+        np.testing.assert_allclose(a['Upwelling'], b['Upwelling'])
+
+
+def test_dark_model():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    with pytest.raises(ValueError):
+        RadiometricCorrection(cal_paths, dark_model='nearest')
+    r = RadiometricCorrection(cal_paths, dark_model='interpolate')
+    r.set_dark_reference(_ds)
+    darks = ['b000000_s000000_dark.pico', 'b000000_s000009_dark.pico']
+    # per-pixel darks are recovered at the dark capture times
+    for fn in darks:
+        da = _ds[fn]['QEP00984']['Upwelling']
+        unsaturated = da.values < da.attrs['SaturationLevel']
+        np.testing.assert_allclose(r.get_dark_signal(da)[unsaturated],
+                                   da.values[unsaturated])
+    # and interpolated linearly in between
+    before, after = [r.get_dark_signal(_ds[fn]['QEP00984']['Upwelling'])
+                     for fn in darks]
+    light = r.get_dark_signal(
+        _ds['b000000_s000004_light.pico']['QEP00984']['Upwelling'])
+    w = (39.302826 - 35.131872) / (44.272211 - 35.131872)
+    np.testing.assert_allclose(light, before * (1 - w) + after * w)
+
+    x1 = r.transform(_ds)
+    x2 = r.transform(_ds, batch=True)
+    fn = 'b000000_s000004_light.pico'
+    np.testing.assert_allclose(x1[fn]['QEP00984']['Upwelling'],
+                               x2[fn]['QEP00984']['Upwelling'])
+    assert np.isscalar(x1[fn]['QEP00984']['Upwelling'].attrs['DarkSignal'])
+
+    r = RadiometricCorrection(cal_paths, dark_model='mean')
+    r.set_dark_reference(_ds)
+    mean = r.get_dark_signal(_ds[fn]['QEP00984']['Upwelling'])
+    np.testing.assert_allclose(mean, (before + after) / 2)
+
+
+def test_non_linearity_options(read_run):
+    _ds = read_run()
+    fn = 'b000000_s000004_light.pico'
+    expected = RadiometricCorrection(cal_paths).transform(_ds, batch=True)
+    with pytest.raises(ValueError):
+        RadiometricCorrection(cal_paths, dtype=int)
+    lut = RadiometricCorrection(cal_paths, non_linearity_lut=True).transform(
+        _ds, batch=True)
+    single = RadiometricCorrection(cal_paths, dtype=np.float32).transform(
+        _ds, batch=True)
+    for serial, direction in [('QEP00984', 'Upwelling'),
+                              ('FLMS01691', 'Downwelling')]:
+        x = expected[fn][serial][direction]
+        np.testing.assert_allclose(lut[fn][serial][direction], x,
+                                   rtol=1e-12)
+        assert single[fn][serial][direction].dtype == np.float32
+        # float32 loses precision in the dark subtraction of small signals
+        np.testing.assert_allclose(single[fn][serial][direction], x,
+                                   atol=1e-5 * float(abs(x).max()))
+
+
+@pytest.mark.parametrize('batch', [False, True])
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_transform_parallel(batch, executor):
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    r = RadiometricCorrection(cal_paths)
+    x1 = r.transform(_ds)
+    x2 = r.transform(_ds, batch=batch, workers=4, executor=executor)
+    assert list(x1) == list(x2)
+    for fn in x1:
+        for ser in x1[fn]:
+            assert list(x1[fn][ser]) == list(x2[fn][ser])
+            for dirs in x1[fn][ser]:
+                xarray.testing.assert_allclose(x1[fn][ser][dirs],
+                                               x2[fn][ser][dirs])
+
+
+def test_calibration_registry(tmp_path):
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    fn = 'b000000_s000004_light.pico'
+    da = _ds[fn]['QEP00984']['Upwelling']
+    r1 = RadiometricCorrection(cal_paths)
+    r2 = RadiometricCorrection(cal_paths)
+    # parsed once and shared
+    assert r1.get_calibration(da) is r2.get_calibration(da)
+    x1 = r1.transform(_ds)
+    assert r2._get_plan(da).scale is not None
+    xarray.testing.assert_equal(x1[fn]['QEP00984']['Upwelling'],
+                                r2.transform(_ds)[fn]['QEP00984']['Upwelling'])
+
+    # edited files are parsed again
+    path = tmp_path / 'QEP00984_CalCoeffs.csv'
+    path.write_text(open(cal_paths[1]).read())
+    r3 = RadiometricCorrection([str(path)])
+    os.utime(path, ns=(0, 0))
+    r4 = RadiometricCorrection([str(path)])
+    assert r3.get_calibration(da) is not r4.get_calibration(da)
+    xarray.testing.assert_equal(r3.get_calibration(da), r4.get_calibration(da))
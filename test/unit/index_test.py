@@ -0,0 +1,57 @@
+from piccololite import CaptureIndex
+from piccololite.index import INDEX_NAME
+
+import os
+import shutil
+import pandas
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, 'data')
+
+
+def _copy(names, dest):
+    for n in names:
+        shutil.copy(os.path.join(DATA, n), str(dest))
+
+
+def test_index_query():
+    index = CaptureIndex(DATA, persist=False)
+    # 13 files of 4 spectra
+    assert len(index) == 52
+    assert not os.path.exists(os.path.join(DATA, INDEX_NAME))
+    captures = index.query(serial='QEP00984', type='light',
+                           start='2020-05-30T12:38:38Z',
+                           end='2020-05-30T12:38:41Z', integration_time=10)
+    assert list(captures['Filename']) == [
+        'b000000_s000003_light.pico', 'b000000_s000004_light.pico',
+        'b000000_s000005_light.pico', 'b000000_s000006_light.pico']
+    assert (captures['Direction'] == 'Upwelling').all()
+    assert len(index.query(dark=True)) == 8
+    assert len(index.query(type=['dark'], direction='Downwelling')) == 4
+
+    # only the matching files are read
+    seq = index.load(captures)
+    assert list(seq) == list(captures['Filename'])
+    assert seq['b000000_s000004_light.pico']['QEP00984']['Upwelling'].attrs[
+        'SequenceNumber'] == 4
+
+
+def test_index_persisted(tmp_path):
+    _copy(['b000000_s000000_dark.pico', 'b000000_s000000_light.pico'],
+          tmp_path)
+    index = CaptureIndex(str(tmp_path))
+    assert os.path.exists(os.path.join(str(tmp_path), INDEX_NAME))
+
+    reopened = CaptureIndex(str(tmp_path), update=False)
+    assert reopened.update() == 0
+    pandas.testing.assert_frame_equal(reopened.captures, index.captures,
+                                      check_dtype=False)
+    # only new files are read
+    _copy(['b000000_s000001_light.pico'], tmp_path)
+    assert reopened.update() == 1
+    assert len(reopened) == 12
+    os.remove(os.path.join(str(tmp_path), 'b000000_s000000_dark.pico'))
+    reopened.update()
+    assert list(reopened.files()) == [
+        os.path.join(str(tmp_path), x) for x in
+        ['b000000_s000000_light.pico', 'b000000_s000001_light.pico']]
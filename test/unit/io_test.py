@@ -1,8 +1,12 @@
 from piccololite import read_piccolo_file, read_piccolo_sequence, \
 sequence_to_datasets, aggregate_sequence
+from piccololite import SequenceReadError, PiccoloSequence, SpectrumHeader
+from piccololite.io import _parse_pico_string, _parse_from_string
 
 import os
 import json
+import numpy as np
+import pytest
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 
@@ -78,3 +82,139 @@ def _check_b000000_s000000_dark(ds):
     # Manually checked array lengths
     assert len(ds['FLMS01691']['Upwelling']) == 2048
     assert len(ds['QEP00984']['Upwelling']) == 1044
+
+
+def test_fast_parser_matches_json():
+    for fname in sorted(os.listdir(os.path.join(HERE, 'data'))):
+        if not fname.endswith('.pico'):
+            continue
+        with open(os.path.join(HERE, 'data', fname), 'r') as f:
+            text = f.read()
+        fast = _parse_pico_string(text)
+        slow = json.loads(text)
+        for a, b in zip(fast['Spectra'], slow['Spectra']):
+            assert a['Metadata'] == b['Metadata']
+            np.testing.assert_array_equal(a['Pixels'], b['Pixels'])
+
+
+def test_fast_parser_fallback():
+    text = json.dumps({'Spectra': [{'Metadata': {}, 'Pixels': [1, None]}]})
+    with pytest.raises(ValueError):
+        _parse_pico_string(text)
+    assert _parse_from_string(text)['Spectra'][0]['Pixels'] == [1, None]
+
+
+def test_metadata_only_read():
+    path = os.path.join(HERE, 'data', 'b000000_s000005_light.pico')
+    full = read_piccolo_file(path)
+    headers = read_piccolo_file(path, metadata_only=True)
+    assert list(headers) == list(full)
+    for serial, directions in full.items():
+        for direction, da in directions.items():
+            header = headers[serial][direction]
+            assert isinstance(header, SpectrumHeader)
+            assert header.attrs == da.attrs
+            assert len(header) == len(da)
+            np.testing.assert_array_equal(header.load(), da)
+    # strings and json fallback
+    with open(path, 'r') as f:
+        text = f.read()
+    assert len(read_piccolo_file(text, metadata_only=True)['QEP00984'][
+        'Upwelling']) == 1044
+    text = json.dumps({'Spectra': [{'Metadata': {
+        'SerialNumber': 'x', 'Direction': 'upwelling'}, 'Pixels': [1, None]}]})
+    header = read_piccolo_file(text, metadata_only=True)['X']['Upwelling']
+    assert len(header) == 2
+    with pytest.raises(ValueError):
+        header.load()
+    with pytest.raises(ValueError):
+        read_piccolo_file(path, metadata_only=True, compact=True)
+
+    seq = read_piccolo_sequence(os.path.join(HERE, 'data'),
+                                metadata_only=True)
+    assert seq['b000000_s000000_dark.pico']['FLMS01691'][
+        'Downwelling'].attrs['Dark']
+
+
+def test_parallel_read():
+    serial = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    for executor in ['thread', 'process']:
+        _ds = read_piccolo_sequence(os.path.join(HERE, 'data'), workers=2,
+                                    executor=executor)
+        assert list(_ds) == list(serial)
+        _check_b000000_s000005_light(_ds['b000000_s000005_light.pico'])
+
+
+def test_read_errors_collected(tmp_path):
+    bad = tmp_path / 'b000000_s000099_light.pico'
+    bad.write_text('not json')
+    files = [os.path.join(HERE, 'data', 'b000000_s000005_light.pico'),
+             str(bad)]
+    with pytest.raises(SequenceReadError) as e:
+        read_piccolo_sequence(files, workers=2)
+    assert list(e.value.errors) == ['b000000_s000099_light.pico']
+    assert list(e.value.sequence) == ['b000000_s000005_light.pico']
+    _ds = read_piccolo_sequence(files, errors='skip')
+    assert list(_ds) == ['b000000_s000005_light.pico']
+
+
+def test_lazy_sequence():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'), lazy=True,
+                                cache_size=2)
+    assert isinstance(_ds, PiccoloSequence)
+    assert len(_ds) == 13
+    assert 'b000000_s000009_dark.pico' in _ds
+    assert _ds.index.loc['b000000_s000009_dark.pico', 'Type'] == 'dark'
+    assert _ds.index.loc['b000000_s000009_dark.pico', 'SequenceNumber'] == 9
+    assert len(_ds._cache) == 0
+    _check_b000000_s000005_light(_ds['b000000_s000005_light.pico'])
+    for _ in _ds.values():
+        pass
+    assert len(_ds._cache) == 2
+    with pytest.raises(KeyError):
+        _ds['missing.pico']
+    _new = sequence_to_datasets(_ds)
+    assert len(_new['QEP00984']) == 26
+    _ = aggregate_sequence(_ds)
+    with pytest.raises(ValueError):
+        read_piccolo_sequence(os.path.join(HERE, 'data'), lazy=True,
+                              workers=2)
+    with pytest.raises(ValueError):
+        read_piccolo_sequence(os.path.join(HERE, 'data'), lazy=True,
+                              errors='skip')
+
+
+def test_sequence_to_datasets_capture():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    _new = sequence_to_datasets(_ds, layout='capture')
+    qep = _new['QEP00984']
+    assert set(qep.data_vars) == {'Upwelling', 'Downwelling'}
+    assert qep['Upwelling'].dims == ('capture', 'wavelength')
+    assert len(qep.capture) == 13
+    np.testing.assert_array_equal(
+        qep['Upwelling'].sel(capture='b000000_s000005_light').dropna(
+            'wavelength'),
+        _ds['b000000_s000005_light.pico']['QEP00984']['Upwelling'])
+    assert qep['Upwelling_SequenceNumber'].sel(
+        capture='b000000_s000005_light') == 5
+    assert qep['Upwelling'].attrs['IntegrationTimeUnits'] == 'milliseconds'
+
+
+def test_aggregate_streaming():
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    _lazy = read_piccolo_sequence(os.path.join(HERE, 'data'), lazy=True,
+                                  cache_size=1)
+    _compact = read_piccolo_sequence(os.path.join(HERE, 'data'), lazy=True,
+                                     cache_size=1, compact=True)
+    for test in ['mean', 'median', 'var', 'std', 'min', 'max']:
+        a = aggregate_sequence(_ds, test)
+        for seq in [_lazy, _compact]:
+            b = aggregate_sequence(seq, test, streaming=True)
+            for direc in ['Upwelling', 'Downwelling']:
+                np.testing.assert_allclose(a['QEP00984'][direc],
+                                           b['QEP00984'][direc],
+                                           equal_nan=True)
+                assert a['QEP00984'][direc].attrs['IncludedFiles'] == \
+                    b['QEP00984'][direc].attrs['IncludedFiles']
+    with pytest.raises(ValueError):
+        aggregate_sequence(_ds, 'median', streaming=True, median_buffer=1)
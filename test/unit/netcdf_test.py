@@ -0,0 +1,117 @@
+from piccololite import read_piccolo_sequence, sequence_to_datasets, \
+NetCDFWriter
+
+import os
+import netCDF4
+import numpy as np
+import pytest
+import xarray
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_netcdf_round_trip(tmp_path, read_run):
+    _ds = read_run()
+    writer = NetCDFWriter(str(tmp_path / 'out.nc'), capture_chunk=4,
+                          complevel=2)
+    writer.append(_ds)
+    path = writer.get_path('QEP00984')
+    with netCDF4.Dataset(path) as nc:
+        assert nc.dimensions['capture'].isunlimited()
+        assert nc['Upwelling'].chunking() == [4, 1044]
+        assert nc['Upwelling'].filters()['zlib']
+        assert nc['Upwelling'].filters()['shuffle']
+    expected = sequence_to_datasets(_ds, layout='capture')['QEP00984']
+    with xarray.open_dataset(path) as out:
+        np.testing.assert_array_equal(out['Upwelling'],
+                                      expected['Upwelling'])
+        assert list(out['capture'].values) == \
+            list(expected['capture'].values)
+        np.testing.assert_array_equal(out['Upwelling_Datetime'],
+                                      expected['Upwelling_Datetime'])
+        assert out['Upwelling'].attrs['SaturationLevel'] == 200000
+
+
+def test_netcdf_append(tmp_path, read_run):
+    _ds = read_run()
+    keys = list(_ds)
+    writer = NetCDFWriter(str(tmp_path / 'part.nc'))
+    writer.append({k: _ds[k] for k in keys[:2]})
+    writer.append({k: _ds[k] for k in keys[2:]})
+    whole = NetCDFWriter(str(tmp_path / 'whole.nc'))
+    whole.append(_ds)
+    with xarray.open_dataset(writer.get_path('FLMS01691')) as a, \
+            xarray.open_dataset(whole.get_path('FLMS01691')) as b:
+        assert a.sizes['capture'] == 12
+        for k in ['Downwelling', 'Downwelling_Dark',
+                  'Downwelling_SequenceNumber', 'Downwelling_Datetime']:
+            np.testing.assert_array_equal(a[k], b[k])
+        # constant in the first batch, promoted to a column by the second
+        assert 'SequenceNumber' not in a['Downwelling'].attrs
+
+
+def test_netcdf_grid_mismatch(tmp_path):
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    writer = NetCDFWriter(str(tmp_path / 'out.nc'))
+    writer.append({'b000000_s000000_light.pico':
+                   _ds['b000000_s000000_light.pico']})
+    with pytest.raises(ValueError):
+        writer.append({'b000000_s000010_light.pico':
+                       _ds['b000000_s000010_light.pico']})
+
+
+def test_netcdf_append_single_captures(tmp_path, read_run):
+    _ds = read_run()
+    writer = NetCDFWriter(str(tmp_path / 'part.nc'))
+    for k in _ds:
+        writer.append({k: _ds[k]})
+    whole = NetCDFWriter(str(tmp_path / 'whole.nc'))
+    whole.append(_ds)
+    with xarray.open_dataset(writer.get_path('QEP00984')) as a, \
+            xarray.open_dataset(whole.get_path('QEP00984')) as b:
+        assert sorted(a.data_vars) == sorted(b.data_vars)
+        for k in b.data_vars:
+            assert a[k].equals(b[k])
+        assert set(a['Upwelling'].attrs) == set(b['Upwelling'].attrs)
+        assert 'Datetime' not in a['Upwelling'].attrs
+
+
+def test_netcdf_column_types(tmp_path, read_run):
+    _ds = read_run()
+    keys = list(_ds)
+    times = [[10, 20], [10.5, 30.25]]
+    writer = NetCDFWriter(str(tmp_path / 'out.nc'))
+    for batch, values in zip([keys[:2], keys[2:4]], times):
+        seq = {}
+        for k, t in zip(batch, values):
+            da = _ds[k]['QEP00984']['Upwelling'].copy()
+            da.attrs['IntegrationTime'] = t
+            seq[k] = {'QEP00984': {'Upwelling': da, 'Downwelling': None}}
+        writer.append(seq)
+    with xarray.open_dataset(writer.get_path('QEP00984')) as out:
+        np.testing.assert_array_equal(out['Upwelling_IntegrationTime'],
+                                      [10, 20, 10.5, 30.25])
+    # values that cannot be held by a column are not silently dropped, and
+    # nothing is written
+    path = writer.get_path('QEP00984')
+    da = _ds[keys[4]]['QEP00984']['Upwelling'].copy()
+    da.attrs['Dark'] = 0.5
+    with pytest.raises(ValueError):
+        writer.append({keys[4]: {'QEP00984': {'Upwelling': da,
+                                              'Downwelling': None}}})
+    # a bool column cannot hold a missing value
+    del da.attrs['Dark']
+    with pytest.raises(ValueError):
+        writer.append({keys[4]: {'QEP00984': {'Upwelling': da,
+                                              'Downwelling': None}}})
+    with xarray.open_dataset(path) as out:
+        assert out.sizes['capture'] == 4
+    # a new key is missing for the earlier captures
+    da.attrs['Dark'] = False
+    da.attrs['Saturated'] = True
+    writer.append({keys[4]: {'QEP00984': {'Upwelling': da,
+                                          'Downwelling': None}}})
+    with xarray.open_dataset(path) as out:
+        np.testing.assert_array_equal(out['Upwelling_Saturated'],
+                                      [np.nan] * 4 + [1])
+        assert not out['Upwelling_Dark'].values[-1]
@@ -0,0 +1,49 @@
+from piccololite.nonlinearity import correct_non_linearity, horner, \
+    lookup_non_linearity, non_linearity_lut
+import numpy as np
+
+COEFS = [0.88, 5.5e-06, -5.4e-10, 2.6e-14, -6.5e-19, 8.6e-24, -5.8e-29,
+         1.5e-34]
+
+
+def test_horner():
+    x = np.linspace(0, 60000, 101)
+    np.testing.assert_allclose(horner(COEFS, x),
+                               np.poly1d(COEFS[::-1])(x), rtol=1e-12)
+
+
+def test_correct_non_linearity():
+    raw = np.random.default_rng(0).integers(0, 60000, (4, 50))
+    dark = np.array([[1000.], [1100.], [1200.], [1300.]])
+    expected = dark + (raw - dark) / np.poly1d(COEFS[::-1])(raw - dark)
+    x = raw.astype(float)
+    out = correct_non_linearity(x, COEFS, dark)
+    assert out is x
+    np.testing.assert_allclose(out, expected, rtol=1e-12)
+    out = correct_non_linearity(raw.astype(np.float32), COEFS, dark)
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, expected, rtol=1e-5)
+
+
+def test_lookup_non_linearity():
+    raw = np.random.default_rng(0).integers(0, 60000, (4, 50))
+    dark = np.full((4, 1), 1000.5)
+    expected = correct_non_linearity(raw.astype(float), COEFS, dark)
+    np.testing.assert_allclose(
+        lookup_non_linearity(raw.astype(np.uint32), COEFS, dark, 65535),
+        expected, rtol=1e-12)
+    np.testing.assert_allclose(
+        lookup_non_linearity(raw.astype(float), COEFS, dark, 65535),
+        expected, rtol=1e-12)
+    # not applicable
+    assert lookup_non_linearity(raw + 0.5, COEFS, dark, 65535) is None
+    assert lookup_non_linearity(raw, COEFS, dark, 1000) is None
+    assert lookup_non_linearity(raw, COEFS, dark + np.arange(4)[:, None],
+                                65535) is None
+
+
+def test_lookup_cache_is_bounded():
+    raw = np.arange(100).reshape(2, 50)
+    for dark in range(10):
+        lookup_non_linearity(raw, COEFS, np.full((2, 1), float(dark)), 65535)
+    assert non_linearity_lut.cache_info().currsize <= 4
@@ -0,0 +1,47 @@
+from piccololite import read_piccolo_sequence, RadiometricCorrection, \
+profile
+from piccololite import profiling
+
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_profile():
+    with profile() as p:
+        _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+        RadiometricCorrection().transform(_ds, batch=True)
+    assert not profiling.enabled()
+    df = p.to_dataframe()
+    reads = df[df['stage'] == 'read']
+    assert sorted(reads['file']) == sorted(_ds)
+    summary = p.summary()
+    for stage in ['prepare', 'non_linearity', 'trim', 'dark', 'integration',
+                  'bandwidth_gain', 'output']:
+        assert summary.loc[stage, 'count'] > 0
+    assert summary.loc['trim', 'nbytes'] > 0
+    # nothing is recorded once the context exits
+    read_piccolo_sequence(os.path.join(HERE, 'data'))
+    assert len(p.records) == len(df)
+
+
+def test_hook():
+    calls = []
+
+    def hook(stage, seconds, info):
+        calls.append((stage, seconds, info))
+    profiling.add_hook(hook)
+    try:
+        read_piccolo_sequence([os.path.join(HERE, 'data',
+                                            'b000000_s000000_light.pico')])
+    finally:
+        profiling.remove_hook(hook)
+    assert calls[0][0] == 'read'
+    assert calls[0][2]['spectra'] == 4
+
+
+def test_profile_compact_read():
+    for kwargs in [{'compact': True}, {'metadata_only': True}]:
+        with profile() as p:
+            _ds = read_piccolo_sequence(os.path.join(HERE, 'data'), **kwargs)
+        assert sorted(p.to_dataframe()['file']) == sorted(_ds)
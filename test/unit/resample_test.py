@@ -0,0 +1,54 @@
+from piccololite import read_piccolo_sequence
+from piccololite.resample import get_resampler, resample, resample_to_bands
+
+import os
+import numpy as np
+import pytest
+import xarray
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_resample_matches_interp():
+    ref = xarray.load_dataarray(os.path.join(HERE, 'data',
+                                             'F1380_irradiance.nc'))
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    target = _ds['b000000_s000001_light.pico']['FLMS01691']['Upwelling']
+    xarray.testing.assert_allclose(resample(ref, target['wavelength']),
+                                   ref.interp_like(target), rtol=1e-12)
+    # outside the source grid
+    assert np.isnan(resample(ref, [100., 3000.])).all()
+    # cached by grid
+    assert get_resampler(ref['wavelength'], target['wavelength']) is \
+        get_resampler(ref['wavelength'], target['wavelength'])
+
+
+def test_resample_batch():
+    source = np.array([3., 1., 2., 4.])
+    values = np.array([[30., 10., 20., np.nan],
+                       [3., 1., 2., 4.]])
+    r = get_resampler(source, [1., 1.5, 3., 3.5, 5.])
+    out = r(values)
+    np.testing.assert_allclose(out[0], [10., 15., 30., np.nan, np.nan])
+    np.testing.assert_allclose(out[1], [1., 1.5, 3., 3.5, np.nan])
+    with pytest.raises(ValueError):
+        r(values[:, :3])
+
+
+def test_resample_to_bands():
+    wavelength = np.linspace(400, 800, 401)
+    x = xarray.DataArray(np.stack([np.ones(401), wavelength]),
+                         dims=('capture', 'wavelength'),
+                         coords={'wavelength': wavelength})
+    bands = resample_to_bands(x, [500., 600.], 20.)
+    assert bands.dims == ('capture', 'wavelength')
+    np.testing.assert_allclose(bands[0], 1.)
+    np.testing.assert_allclose(bands[1], [500., 600.], rtol=1e-6)
+
+    srf = xarray.DataArray([[0., 1., 0.], [0., 0., 1.]],
+                           dims=('band', 'wavelength'),
+                           coords={'band': ['a', 'b'],
+                                   'wavelength': [490., 500., 510.]})
+    bands = resample_to_bands(x, srf=srf)
+    assert list(bands['band'].values) == ['a', 'b']
+    np.testing.assert_allclose(bands[1], bands['wavelength'])
@@ -0,0 +1,51 @@
+from piccololite.stats import RunningStatistics
+
+import numpy as np
+import pytest
+
+
+def _random_spectra(n=50, pixels=20, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(100, 10, (n, pixels))
+    x[3, 4] = np.nan
+    return x
+
+
+def test_running_statistics():
+    x = _random_spectra()
+    wvl = np.arange(x.shape[1])
+    stats = RunningStatistics(median=True, median_buffer=101)
+    for row in x:
+        stats.update(row, wvl)
+    np.testing.assert_allclose(stats.result('mean'), np.nanmean(x, axis=0))
+    np.testing.assert_allclose(stats.result('var'), np.nanvar(x, axis=0))
+    np.testing.assert_allclose(stats.result('std'), np.nanstd(x, axis=0))
+    np.testing.assert_array_equal(stats.result('min'), np.nanmin(x, axis=0))
+    np.testing.assert_array_equal(stats.result('max'), np.nanmax(x, axis=0))
+    np.testing.assert_array_equal(stats.result('median'),
+                                  np.nanmedian(x, axis=0))
+
+
+def test_remedian_bounded():
+    x = _random_spectra(n=500)
+    wvl = np.arange(x.shape[1])
+    stats = RunningStatistics(median=True, median_buffer=5)
+    for row in x:
+        stats.update(row, wvl)
+    assert sum(len(level) for level in stats._levels) <= 5 * 4
+    # approximate, but close for well behaved data
+    np.testing.assert_allclose(stats.result('median'),
+                               np.nanmedian(x, axis=0), rtol=.05)
+    for n in [0, 1]:
+        with pytest.raises(ValueError):
+            RunningStatistics(median=True, median_buffer=n)
+
+
+def test_regrid():
+    stats = RunningStatistics()
+    stats.update([1., 2.], [500., 501.])
+    stats.update([3., 4.], [501., 502.])
+    np.testing.assert_array_equal(stats.wavelength, [500., 501., 502.])
+    np.testing.assert_array_equal(stats.result('mean'), [1., 2.5, 4.])
+    with pytest.raises(ValueError):
+        stats.result('median')
@@ -0,0 +1,55 @@
+from piccololite import read_piccolo_sequence, sequence_to_store, \
+open_sequence_store, SequenceStore
+
+import os
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_store_round_trip(tmp_path, read_run):
+    _ds = read_run()
+    sequence_to_store(_ds, str(tmp_path / 'store'))
+    out = open_sequence_store(str(tmp_path / 'store'))
+    assert set(out) == {'QEP00984', 'FLMS01691'}
+    qep = out['QEP00984']
+    assert qep['Upwelling'].shape == (12, 1044)
+    assert isinstance(qep['Upwelling'].variable._data, np.memmap)
+    fn = 'b000000_s000005_light.pico'
+    np.testing.assert_array_equal(
+        qep['Upwelling'].sel(capture=fn[:-5]),
+        _ds[fn]['QEP00984']['Upwelling'])
+    # varying metadata are columns, constant metadata are attributes
+    assert list(qep['Upwelling_SequenceNumber'].values) == \
+        [0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9]
+    assert qep['Upwelling_Datetime'].dtype.kind == 'M'
+    assert qep['Upwelling'].attrs['SaturationLevel'] == 200000
+
+
+def test_store_append(tmp_path, read_run):
+    _ds = read_run()
+    keys = list(_ds)
+    path = str(tmp_path / 'store')
+    sequence_to_store({k: _ds[k] for k in keys[:2]}, path)
+    store = sequence_to_store({k: _ds[k] for k in keys[2:]}, path)
+    assert len(store) == 12
+    whole = str(tmp_path / 'whole')
+    sequence_to_store(_ds, whole)
+    a = open_sequence_store(path)['FLMS01691']
+    b = open_sequence_store(whole)['FLMS01691']
+    np.testing.assert_array_equal(a['Downwelling'], b['Downwelling'])
+    np.testing.assert_array_equal(a['Downwelling_Dark'],
+                                  b['Downwelling_Dark'])
+    np.testing.assert_array_equal(a['Downwelling_SequenceNumber'],
+                                  b['Downwelling_SequenceNumber'])
+
+
+def test_store_grid_mismatch(tmp_path):
+    _ds = read_piccolo_sequence(os.path.join(HERE, 'data'))
+    store = SequenceStore(str(tmp_path / 'store'))
+    store.append({'b000000_s000000_light.pico':
+                  _ds['b000000_s000000_light.pico']})
+    with pytest.raises(ValueError):
+        store.append({'b000000_s000010_light.pico':
+                      _ds['b000000_s000010_light.pico']})
@@ -0,0 +1,88 @@
+from piccololite import read_piccolo_sequence, RadiometricCorrection, \
+SequenceWatcher, open_sequence_store
+
+import os
+import shutil
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, 'data')
+cals = ['FLMS01691_CalCoeffs.csv', 'QEP00984_CalCoeffs.csv']
+cal_paths = [os.path.join(DATA, x) for x in cals]
+
+
+def _copy(names, dest):
+    for n in names:
+        shutil.copy(os.path.join(DATA, n), str(dest))
+
+
+def test_watcher_incremental(tmp_path):
+    raw = tmp_path / 'raw'
+    raw.mkdir()
+    watcher = SequenceWatcher(str(raw), RadiometricCorrection(cal_paths),
+                              output=str(tmp_path / 'store'))
+    assert watcher.update() == {}
+
+    # light files are held until a dark file arrives
+    _copy(['b000000_s000001_light.pico', 'b000000_s000002_light.pico'], raw)
+    assert watcher.update() == {}
+    _copy(['b000000_s000000_dark.pico', 'b000000_s000000_light.pico'], raw)
+    out = watcher.update()
+    assert sorted(out) == ['b000000_s000000_light.pico',
+                           'b000000_s000001_light.pico',
+                           'b000000_s000002_light.pico']
+    assert watcher.dark_file == 'b000000_s000000_dark.pico'
+
+    # partially written files are retried
+    (raw / 'b000000_s000003_light.pico').write_text('{"Spectra": [')
+    assert watcher.update() == {}
+    _copy(['b000000_s000003_light.pico'], raw)
+    assert list(watcher.update()) == ['b000000_s000003_light.pico']
+    assert watcher.update() == {}
+
+    # results match a full transform with the same dark reference
+    full = RadiometricCorrection(cal_paths, 'b000000_s000000_dark.pico')
+    expected = full.transform(read_piccolo_sequence(str(raw)))
+    store = open_sequence_store(str(tmp_path / 'store'))['QEP00984']
+    assert len(store.capture) == 4
+    for fn in ['b000000_s000001_light.pico', 'b000000_s000003_light.pico']:
+        np.testing.assert_allclose(
+            store['Upwelling'].sel(capture=fn[:-5]),
+            expected[fn]['QEP00984']['Upwelling'])
+
+
+def test_watcher_new_dark(tmp_path):
+    raw = tmp_path / 'raw'
+    raw.mkdir()
+    watcher = SequenceWatcher(str(raw), RadiometricCorrection(cal_paths))
+    _copy(['b000000_s000000_dark.pico', 'b000000_s000008_light.pico',
+           'b000000_s000009_dark.pico', 'b000000_s000009_light.pico'], raw)
+    out = watcher.update()
+    assert watcher.dark_file == 'b000000_s000009_dark.pico'
+    assert out['b000000_s000008_light.pico']['QEP00984']['Upwelling']\
+        .attrs['DarkSignal'] != \
+        out['b000000_s000009_light.pico']['QEP00984']['Upwelling']\
+        .attrs['DarkSignal']
+
+
+def test_watcher_corrupt_file(tmp_path):
+    raw = tmp_path / 'raw'
+    raw.mkdir()
+    watcher = SequenceWatcher(str(raw), RadiometricCorrection(cal_paths),
+                              max_attempts=2)
+    _copy(['b000000_s000000_dark.pico'], raw)
+    corrupt = raw / 'b000000_s000001_light.pico'
+    corrupt.write_text('{"Spectra": [')
+    assert watcher.update() == {}
+    assert not watcher.failed
+    # unchanged after max_attempts reads, so it is given up on
+    assert watcher.update() == {}
+    assert list(watcher.failed) == ['b000000_s000001_light.pico']
+    assert not watcher._retry
+    assert watcher.update() == {}
+    assert watcher._attempts['b000000_s000001_light.pico'][1] == 2
+
+    # and retried once it changes
+    _copy(['b000000_s000001_light.pico'], raw)
+    assert list(watcher.update()) == ['b000000_s000001_light.pico']
+    assert not watcher.failed
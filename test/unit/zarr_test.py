@@ -0,0 +1,62 @@
+from piccololite import read_piccolo_sequence, sequence_to_datasets, \
+sequence_to_zarr, sequence_to_zarr_region
+from piccololite._parallel import map_ordered
+
+import functools
+import os
+import numpy as np
+import pytest
+import xarray
+
+pytest.importorskip('zarr')
+pytest.importorskip('dask')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_zarr_round_trip(tmp_path, read_run):
+    _ds = read_run()
+    store = str(tmp_path / 'out.zarr')
+    sequence_to_zarr(_ds, store, capture_chunk=2)
+    expected = sequence_to_datasets(_ds, False, 'capture')
+    for serial in ['QEP00984', 'FLMS01691']:
+        out = xarray.open_zarr(store, group=serial)
+        n_pixels = expected[serial].sizes['wavelength']
+        assert out['Upwelling'].encoding['chunks'] == (2, n_pixels)
+        xarray.testing.assert_equal(out['Upwelling'].isel(capture=3),
+                                    expected[serial]['Upwelling'].isel(
+                                        capture=3))
+        np.testing.assert_array_equal(out['Downwelling_Datetime'],
+                                      expected[serial]['Downwelling_Datetime'])
+
+
+def _write_part(keys, store):
+    # run in a process pool, so files are read by name
+    _ds = read_piccolo_sequence([os.path.join(HERE, 'data', k)
+                                 for k in keys])
+    sequence_to_zarr_region(_ds, store)
+
+
+def test_zarr_parallel_regions(tmp_path, read_run):
+    store = str(tmp_path / 'out.zarr')
+    lazy = read_run(dask=True)
+    sequence_to_zarr(lazy, store, capture_chunk=4, compute=False)
+    empty = xarray.open_zarr(store, group='QEP00984')
+    assert np.isnan(empty['Upwelling'].values).all()
+
+    keys = list(lazy)
+    parts = [keys[:4], keys[4:8], keys[8:]]
+    results = map_ordered(functools.partial(_write_part, store=store),
+                          parts, workers=3, executor='process')
+    assert all(e is None for _, e in results)
+
+    _ds = read_run()
+    out = xarray.open_zarr(store, group='FLMS01691')
+    np.testing.assert_array_equal(
+        out['Downwelling'].values,
+        sequence_to_datasets(_ds, False, 'capture')['FLMS01691'][
+            'Downwelling'].values)
+
+    # ranges not aligned to chunks could race with other writers
+    with pytest.raises(ValueError):
+        sequence_to_zarr_region({k: _ds[k] for k in keys[1:3]}, store)